@@ -111,6 +111,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'yksshop.context_processors.cart',
             ],
         },
     },
@@ -143,6 +144,35 @@ else:
         }
     }
 
+# Cache
+# Use Redis if REDIS_URL is set so all workers share cache versions; otherwise per-process memory
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Without a shared cache, seconds each worker keeps in-memory reference data/indexes
+# before reloading (version bumps from other workers aren't visible). Set REDIS_URL
+# whenever more than one worker process runs.
+LOCAL_CACHE_MAX_AGE = int(os.environ.get('LOCAL_CACHE_MAX_AGE', 60))
+
+# Seconds a rendered homepage/catalog/product page is reused for anonymous visitors
+ANONYMOUS_PAGE_CACHE_TIMEOUT = int(os.environ.get('ANONYMOUS_PAGE_CACHE_TIMEOUT', 300))
+
+# Seconds a response stored under an Idempotency-Key is replayed to retries
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 60 * 60 * 24))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -266,7 +296,7 @@ else:
 # REST Framework Configuration with JWT
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'yksshop.jwt_auth.CachedJWTAuthentication',  # simplejwt, with cached user lookups
         'rest_framework.authentication.SessionAuthentication',  # Keep session auth for admin
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -307,12 +337,25 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
+# Per-process cache of users authenticated by JWT (see yksshop/jwt_auth.py)
+JWT_USER_CACHE_TTL = int(os.environ.get('JWT_USER_CACHE_TTL', 30))  # seconds
+JWT_USER_CACHE_SIZE = int(os.environ.get('JWT_USER_CACHE_SIZE', 1024))
+
 # WhatsApp Notification Settings (Twilio)
 # Get your credentials from: https://www.twilio.com/try-twilio
 WHATSAPP_ENABLED = False  # Set to True after configuring Twilio
 TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID', '')
 TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN', '')
 TWILIO_WHATSAPP_FROM = os.environ.get('TWILIO_WHATSAPP_FROM', '')  # Format: +14155238886
+# Messages per second sent to Twilio (token bucket; bursts up to the same size)
+WHATSAPP_RATE_LIMIT = float(os.environ.get('WHATSAPP_RATE_LIMIT', 10))
+
+# Order status notifications
+# Changes within this many seconds of the first one go out as a single message
+NOTIFICATION_COALESCE_WINDOW = int(os.environ.get('NOTIFICATION_COALESCE_WINDOW', 120))
+# Send one daily digest per customer instead (at NOTIFICATION_DIGEST_HOUR, local time)
+NOTIFICATION_STATUS_DIGEST = os.environ.get('NOTIFICATION_STATUS_DIGEST', 'False').lower() == 'true'
+NOTIFICATION_DIGEST_HOUR = int(os.environ.get('NOTIFICATION_DIGEST_HOUR', 9))
 
 # Razorpay Payment Gateway Settings (Sandbox)
 # Get your credentials from: https://dashboard.razorpay.com/app/keys
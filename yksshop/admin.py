@@ -1,4 +1,4 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.utils.html import format_html
 from .models import (
     Profile,
@@ -12,7 +12,10 @@ from .models import (
     Order,
     OrderItem,
     HomeHero,
+    OutboxMessage,
+    StockSubscription,
 )
+from .orders import update_order_status
 
 admin.site.register(Profile)
 admin.site.register(PendingUser)
@@ -88,6 +91,7 @@ class ProductAdmin(admin.ModelAdmin):
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
     list_display = ['user', 'get_item_count', 'get_total', 'created_at']
+    readonly_fields = ['item_count', 'total']
 
     def get_item_count(self, obj):
         return obj.get_item_count()
@@ -102,6 +106,20 @@ class CartAdmin(admin.ModelAdmin):
 class CartItemAdmin(admin.ModelAdmin):
     list_display = ['cart', 'product', 'size', 'quantity', 'get_total']
 
+    # Keep the cart's denormalized item count / total in step with manual edits
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        Cart.objects.filter(pk=obj.cart_id).reconcile()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        Cart.objects.filter(pk=obj.cart_id).reconcile()
+
+    def delete_queryset(self, request, queryset):
+        cart_ids = list(queryset.values_list('cart_id', flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        Cart.objects.filter(pk__in=cart_ids).reconcile()
+
     def get_total(self, obj):
         return f"Rs.{obj.get_total():.2f}"
     get_total.short_description = 'Total'
@@ -113,6 +131,25 @@ class OrderAdmin(admin.ModelAdmin):
     list_filter = ['status', 'payment_method', 'created_at']
     search_fields = ['order_number', 'user__username', 'user__email']
     readonly_fields = ['order_number', 'created_at', 'updated_at']
+    actions = ['mark_processing', 'mark_shipped', 'mark_delivered']
+
+    def _mark(self, request, queryset, status):
+        # One UPDATE for the whole selection; notifications go out via the outbox worker
+        changed = update_order_status(queryset, status)
+        label = dict(Order.STATUS_CHOICES)[status]
+        self.message_user(request, f"{changed} order(s) marked as {label}.", messages.SUCCESS)
+
+    def mark_processing(self, request, queryset):
+        self._mark(request, queryset, 'processing')
+    mark_processing.short_description = 'Mark selected orders as Processing'
+
+    def mark_shipped(self, request, queryset):
+        self._mark(request, queryset, 'shipped')
+    mark_shipped.short_description = 'Mark selected orders as Shipped'
+
+    def mark_delivered(self, request, queryset):
+        self._mark(request, queryset, 'delivered')
+    mark_delivered.short_description = 'Mark selected orders as Delivered'
 
 
 @admin.register(OrderItem)
@@ -124,6 +161,22 @@ class OrderItemAdmin(admin.ModelAdmin):
     get_total.short_description = 'Total'
 
 
+@admin.register(StockSubscription)
+class StockSubscriptionAdmin(admin.ModelAdmin):
+    list_display = ['product', 'size', 'user', 'email', 'phone', 'created_at', 'notified_at']
+    list_filter = ['notified_at']
+    search_fields = ['product__name', 'email', 'user__username']
+    raw_id_fields = ['product', 'user']
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'channel', 'order', 'user', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status', 'kind', 'channel']
+    search_fields = ['order__order_number', 'user__username']
+    readonly_fields = ['created_at', 'sent_at', 'last_error']
+
+
 @admin.register(HomeHero)
 class HomeHeroAdmin(admin.ModelAdmin):
     list_display = ['title', 'updated_at']
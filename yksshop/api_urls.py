@@ -10,9 +10,17 @@ urlpatterns = [
     path('login/', jwt_views.jwt_login, name='jwt_login'),
     path('user/', jwt_views.jwt_user_info, name='jwt_user_info'),
 
+    # Catalog
+    path('products/', views.api_product_list, name='api_product_list'),
+    path('products/suggest/', views.api_product_suggest, name='api_product_suggest'),
+    path('stock-subscribe/', views.stock_subscribe, name='stock_subscribe'),
+
     # AJAX Cart / Orders
+    path('csrf/', views.csrf_cookie, name='csrf_cookie'),
     path('add-to-cart/', views.add_to_cart, name='add_to_cart'),
     path('update-cart/', views.update_cart, name='update_cart'),
     path('remove-from-cart/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/batch/', views.cart_batch, name='cart_batch'),
     path('place-order/', views.place_order, name='place_order'),
+    path('orders/', jwt_views.api_order_list, name='api_order_list'),
 ]
@@ -0,0 +1,208 @@
+"""
+Batched cart mutations
+Applies a list of add/update/remove operations in one go: the current lines are
+read once, stock for every line that grows is checked against one prefetched
+load, and the changes are written with bulk_create/bulk_update/delete inside a
+single transaction. The whole batch is rejected if any operation is invalid.
+
+Operation format (JSON):
+    {"op": "add", "product_id": 3, "size": "M", "quantity": 2}
+    {"op": "update", "cart_item_id": 17, "quantity": 4}
+    {"op": "remove", "cart_item_id": 17}
+"""
+from django.db import transaction
+
+from .guest_cart import line_id, parse_line_id
+from .models import Cart, CartItem, Product
+
+MAX_OPERATIONS = 50
+OPERATIONS = ('add', 'update', 'remove')
+
+
+class CartBatchError(Exception):
+    pass
+
+
+def parse_operations(payload):
+    """Validate the request payload; returns a list of normalized operation dicts"""
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise CartBatchError('No cart operations supplied')
+    if len(operations) > MAX_OPERATIONS:
+        raise CartBatchError(f'Too many cart operations (maximum {MAX_OPERATIONS})')
+
+    parsed = []
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+            raise CartBatchError('Invalid cart operation')
+        try:
+            quantity = int(operation.get('quantity', 1))
+            product_id = int(operation['product_id']) if operation.get('product_id') is not None else None
+            cart_item_id = int(operation['cart_item_id']) if operation.get('cart_item_id') is not None else None
+        except (TypeError, ValueError):
+            raise CartBatchError('Invalid cart operation')
+
+        op = operation['op']
+        if op == 'add' and (product_id is None or quantity <= 0):
+            raise CartBatchError('Add operations need a product_id and a positive quantity')
+        if op != 'add' and cart_item_id is None:
+            raise CartBatchError('Update and remove operations need a cart_item_id')
+
+        parsed.append({
+            'op': op,
+            'product_id': product_id,
+            'cart_item_id': cart_item_id,
+            'size': (operation.get('size') or '').strip().upper() or None,
+            'quantity': quantity,
+        })
+    return parsed
+
+
+def _plan(quantities, operations, resolve_item):
+    """
+    Replay the operations over {(product_id, size): quantity}.
+
+    Returns:
+        tuple: (target quantities, {key: quantity requested by 'add' ops})
+    """
+    targets = dict(quantities)
+    added = {}
+    for operation in operations:
+        if operation['op'] == 'add':
+            key = (operation['product_id'], operation['size'])
+            targets[key] = targets.get(key, 0) + operation['quantity']
+            added[key] = added.get(key, 0) + operation['quantity']
+            continue
+
+        key = resolve_item(operation['cart_item_id'])
+        if key is None or key not in targets:
+            raise CartBatchError('Cart item not found')
+        if operation['op'] == 'remove' or operation['quantity'] <= 0:
+            targets[key] = 0
+        else:
+            targets[key] = operation['quantity']
+    return targets, added
+
+
+def _check_stock(targets, added, current):
+    """
+    Load the products of every remaining line with their variants (one
+    prefetched query pair) and validate the lines whose quantity goes up.
+    Quantities from 'add' ops are capped at stock, like add_to_cart; explicit
+    updates beyond stock fail. Lines that stay the same or shrink are never
+    checked, so a line that went over stock doesn't block edits to the others.
+
+    Returns:
+        dict: {product_id: Product}
+    """
+    product_ids = {product_id for (product_id, _), quantity in targets.items() if quantity > 0}
+    products = Product.objects.filter(pk__in=product_ids).prefetch_related('variants').in_bulk()
+
+    for key, quantity in list(targets.items()):
+        if quantity <= 0:
+            continue
+        product_id, size = key
+        product = products.get(product_id)
+        if quantity <= current.get(key, 0):
+            if product is None:
+                # Product deleted since the line was added: drop the line
+                targets[key] = 0
+            continue
+        if product is None or not product.is_available:
+            raise CartBatchError('Product not found')
+
+        if product.has_size_variants:
+            if not size:
+                raise CartBatchError(f'Please select a size for {product.name}')
+            if not any(variant.size == size for variant in product.variants.all()):
+                raise CartBatchError(f'Selected size is not available for {product.name}')
+        elif size:
+            raise CartBatchError(f'{product.name} does not come in sizes')
+
+        available_stock = product.get_stock_for_size(size)
+        if key in added:
+            if added[key] > available_stock:
+                raise CartBatchError(f'Insufficient stock for {product.name}')
+            targets[key] = min(quantity, available_stock)
+        elif quantity > available_stock:
+            raise CartBatchError(f'Insufficient stock for {product.name}')
+    return products
+
+
+def _line_state(item_id, product, size, quantity):
+    return {
+        'id': item_id,
+        'product_id': product.id,
+        'size': size,
+        'quantity': quantity,
+        'item_total': float(product.price * quantity),
+        'available_stock': product.get_stock_for_size(size),
+    }
+
+
+def apply_to_cart(cart, operations):
+    """
+    Apply `operations` to a persistent Cart.
+
+    Returns:
+        list: the resulting cart lines
+    """
+    with transaction.atomic():
+        # Lock the cart row so concurrent batches for the same user apply in order
+        Cart.objects.select_for_update().filter(pk=cart.pk).first()
+        items = {(item.product_id, item.size): item for item in CartItem.objects.filter(cart=cart)}
+        items_by_id = {item.pk: key for key, item in items.items()}
+
+        current = {key: item.quantity for key, item in items.items()}
+        targets, added = _plan(current, operations, items_by_id.get)
+        products = _check_stock(targets, added, current)
+
+        to_create, to_update, to_delete = [], [], []
+        for key, quantity in targets.items():
+            item = items.get(key)
+            if item is None:
+                if quantity > 0:
+                    item = CartItem(cart=cart, product=products[key[0]], size=key[1], quantity=quantity)
+                    items[key] = item
+                    to_create.append(item)
+            elif quantity <= 0:
+                to_delete.append(item.pk)
+            elif quantity != item.quantity:
+                item.quantity = quantity
+                to_update.append(item)
+
+        if to_delete:
+            CartItem.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            CartItem.objects.bulk_update(to_update, ['quantity'])
+        if to_create:
+            CartItem.objects.bulk_create(to_create)
+        Cart.objects.filter(pk=cart.pk).reconcile()
+        cart.refresh_from_db(fields=['item_count', 'total', 'updated_at'])
+
+    return [
+        _line_state(items[key].pk, products[key[0]], key[1], quantity)
+        for key, quantity in targets.items()
+        if quantity > 0
+    ]
+
+
+def apply_to_guest_cart(guest_cart, operations):
+    """
+    Apply `operations` to a cookie-backed GuestCart (the caller saves the cookie).
+
+    Returns:
+        list: the resulting lines
+    """
+    targets, added = _plan(dict(guest_cart.lines), operations, parse_line_id)
+    products = _check_stock(targets, added, guest_cart.lines)
+
+    for (product_id, size), quantity in targets.items():
+        if not guest_cart.set_quantity(product_id, size, quantity):
+            raise CartBatchError('Your cart is full. Please login to add more items.')
+
+    return [
+        _line_state(line_id(product_id, size), products[product_id], size, quantity)
+        for (product_id, size), quantity in targets.items()
+        if quantity > 0
+    ]
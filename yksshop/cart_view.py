@@ -0,0 +1,73 @@
+"""
+View models for the cart and checkout pages
+The lines, their products, the product variants and the product images are
+loaded in a fixed number of queries; per-line stock, line totals and image
+URLs are then computed in Python, so page cost does not grow with the number
+of lines.
+"""
+from decimal import Decimal
+
+from django.db.models import Prefetch
+
+from .models import CartItem, ProductImage
+
+
+def product_prefetches(prefix=''):
+    """Prefetches a cart line's product needs: variants for stock, images for the thumbnail"""
+    return [
+        f'{prefix}variants',
+        Prefetch(f'{prefix}images', queryset=ProductImage.objects.order_by('pk')),
+    ]
+
+
+class CartLine:
+    """One cart row as the templates see it (same attribute names as CartItem)"""
+
+    def __init__(self, item):
+        self.id = item.id
+        self.item = item
+        self.product = item.product
+        self.size = item.size
+        self.quantity = item.quantity
+        self.available_stock = item.product.get_stock_for_size(item.size)
+        self.get_total = item.product.price * item.quantity
+        self.image_url = item.product.get_image_url
+
+
+class CartView:
+    def __init__(self, lines):
+        self.lines = lines
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    def get_item_count(self):
+        return sum(line.quantity for line in self.lines)
+
+    def get_total(self):
+        return sum((line.get_total for line in self.lines), Decimal('0'))
+
+
+def cart_items_for_display(cart):
+    return (
+        CartItem.objects.filter(cart=cart)
+        .select_related('product')
+        .prefetch_related(*product_prefetches('product__'))
+        .order_by('pk')
+    )
+
+
+def build_cart_view(cart):
+    """View model for a persistent Cart (4 queries regardless of line count)"""
+    return CartView([CartLine(item) for item in cart_items_for_display(cart)])
+
+
+def build_guest_cart_view(guest_cart):
+    """View model for a cookie-backed GuestCart (3 queries regardless of line count)"""
+    return CartView([CartLine(item) for item in guest_cart.get_items()])
@@ -0,0 +1,84 @@
+"""
+Conditional GET (ETag) for catalog responses
+Validators are built from the catalog version and the product, variant and
+image update stamps and cached per catalog version, so answering a
+revalidation with 304 Not Modified normally costs no database query and never
+renders a template.
+
+Without a shared cache other workers never see a catalog version bump (see
+versioning.py), so validators are also capped at local_max_age() seconds:
+cached product ETags expire, and catalog ETags roll over every window.
+
+No Last-Modified is sent: a max(updated_at) doesn't move when a row is deleted
+or a category is renamed, so If-Modified-Since would get stale 304s.
+
+HTML pages contain a per-user header (login state, cart badge), so they only
+get validators for anonymous visitors without a guest cart; the JSON catalog is
+the same for everyone.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.views.decorators.http import condition
+
+from .guest_cart import has_guest_cart
+from .models import Product
+from .versioning import get_version, local_max_age
+
+VALIDATOR_CACHE_TIMEOUT = 60 * 60
+
+
+def _product_etag(slug):
+    """ETag for a product's page (see ProductQuerySet.on_display), or None"""
+    key = f"yksshop:validators:product:{get_version('catalog')}:{slug}"
+    etag = cache.get(key)
+    if etag is None:
+        row = (
+            Product.objects.on_display().filter(slug=slug)
+            .values('pk', 'updated_at', 'category__name', 'category__slug')
+            .annotate(
+                variants_updated=Max('variants__updated_at'),
+                variant_count=Count('variants', distinct=True),
+                images_updated=Max('images__updated_at'),
+                image_count=Count('images', distinct=True),
+            )
+            .first()
+        )
+        # '' caches "no such product" too
+        etag = '' if row is None else hashlib.md5(
+            ':'.join(str(value) for value in row.values()).encode()
+        ).hexdigest()
+        cache.set(key, etag, local_max_age(VALIDATOR_CACHE_TIMEOUT))
+    return etag or None
+
+
+def _catalog_etag(request):
+    signature = f"{get_version('catalog')}:{request.get_full_path()}"
+    max_age = local_max_age()
+    if max_age:
+        signature += f":{int(time.time() // max_age)}"
+    return hashlib.md5(signature.encode()).hexdigest()
+
+
+def _anonymous(func):
+    def wrapper(request, *args, **kwargs):
+        if request.user.is_authenticated or has_guest_cart(request):
+            return None
+        return func(request, *args, **kwargs)
+    return wrapper
+
+
+# Decorators for the views
+product_detail_condition = condition(
+    etag_func=_anonymous(lambda request, slug: _product_etag(slug)),
+)
+
+catalog_page_condition = condition(
+    etag_func=_anonymous(lambda request: _catalog_etag(request)),
+)
+
+catalog_api_condition = condition(
+    etag_func=lambda request: _catalog_etag(request),
+)
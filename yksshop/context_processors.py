@@ -0,0 +1,63 @@
+"""
+Template context processors
+"""
+from django.utils.functional import SimpleLazyObject, cached_property
+
+from .guest_cart import GuestCart
+from .models import Cart
+
+
+class CartSummary:
+    """
+    Item count and total for the current user's cart, loaded on first use and
+    memoized on the request so every template and include shares one query.
+    Anonymous visitors get their signed guest cart cookie: the count needs no
+    query, the total loads the products only if a template asks for it.
+    """
+
+    def __init__(self, request):
+        self._request = request
+
+    @cached_property
+    def _guest_cart(self):
+        return GuestCart.from_request(self._request)
+
+    @cached_property
+    def _values(self):
+        user = getattr(self._request, 'user', None)
+        if not user or not user.is_authenticated:
+            # Total filled in lazily (see `total`)
+            return self._guest_cart.get_item_count(), None
+        row = Cart.objects.filter(user=user).values_list('item_count', 'total').first()
+        return row or (0, 0)
+
+    @property
+    def count(self):
+        return self._values[0]
+
+    @property
+    def total(self):
+        total = self._values[1]
+        if total is None:
+            total = self._guest_cart.get_total()
+        return total
+
+
+def get_cart_summary(request):
+    if not hasattr(request, '_cart_summary'):
+        request._cart_summary = CartSummary(request)
+    return request._cart_summary
+
+
+def remember_cart(request, cart):
+    """Seed the request's summary from a cart a view has already loaded"""
+    summary = get_cart_summary(request)
+    summary.__dict__['_values'] = (cart.item_count, cart.total)
+
+
+def cart(request):
+    summary = get_cart_summary(request)
+    return {
+        'cart_summary': summary,
+        'cart_count': SimpleLazyObject(lambda: summary.count),
+    }
@@ -0,0 +1,185 @@
+"""
+Catalog facets: category, price band and in-stock size
+All facet counts for a result set come from a single aggregate query using
+conditional COUNTs, cached per catalog version and filter combination
+(for at most local_max_age() seconds when versions aren't shared, see versioning.py).
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count, Exists, OuterRef, Q
+
+from .models import ProductVariant
+from .reference_data import reference_data
+from .versioning import get_version, local_max_age
+
+# (key, label, min price inclusive, max price exclusive)
+PRICE_BANDS = [
+    ('0-500', 'Under Rs.500', None, 500),
+    ('500-1000', 'Rs.500 - Rs.1,000', 500, 1000),
+    ('1000-2000', 'Rs.1,000 - Rs.2,000', 1000, 2000),
+    ('2000-', 'Rs.2,000 & above', 2000, None),
+]
+PRICE_BAND_KEYS = {band[0] for band in PRICE_BANDS}
+SIZES = [size for size, _ in ProductVariant.Sizes.choices]
+
+FACET_CACHE_TIMEOUT = 60 * 60
+
+
+def parse_facets(params):
+    """Read the selected facet values from a QueryDict"""
+    price = params.get('price')
+    return {
+        'category': params.get('category') or None,
+        'price': price if price in PRICE_BAND_KEYS else None,
+        'sizes': [size for size in params.getlist('size') if size in SIZES],
+    }
+
+
+def category_q(slug):
+    if not slug:
+        return Q()
+    # Resolved from the in-memory reference data, so no join on the category table
+    category_id = reference_data.category_id(slug)
+    if category_id is None:
+        return Q(pk__in=[])
+    return Q(category_id=category_id)
+
+
+def price_q(band_key):
+    for key, _, low, high in PRICE_BANDS:
+        if key == band_key:
+            q = Q()
+            if low is not None:
+                q &= Q(price__gte=low)
+            if high is not None:
+                q &= Q(price__lt=high)
+            return q
+    return Q()
+
+
+def size_q(sizes):
+    if not sizes:
+        return Q()
+    return Q(Exists(
+        ProductVariant.objects.filter(product=OuterRef('pk'), size__in=sizes, stock__gt=0)
+    ))
+
+
+def apply_facets(queryset, selected):
+    return queryset.filter(
+        category_q(selected['category']),
+        price_q(selected['price']),
+        size_q(selected['sizes']),
+    )
+
+
+def _count_facets(queryset, selected, categories):
+    """
+    One aggregate query. Each facet value is counted against the other facets'
+    selections, so picking a size still shows how many products each price band has.
+    """
+    by_category = price_q(selected['price']) & size_q(selected['sizes'])
+    by_price = category_q(selected['category']) & size_q(selected['sizes'])
+    by_size = category_q(selected['category']) & price_q(selected['price'])
+
+    aggregates = {}
+    for category in categories:
+        aggregates[f'category_{category.pk}'] = Count(
+            'pk', filter=Q(category_id=category.pk) & by_category
+        )
+    for index, (key, _, _, _) in enumerate(PRICE_BANDS):
+        aggregates[f'price_{index}'] = Count('pk', filter=price_q(key) & by_price)
+    for size in SIZES:
+        aggregates[f'size_{size}'] = Count('pk', filter=size_q([size]) & by_size)
+
+    return queryset.order_by().aggregate(**aggregates)
+
+
+def facet_counts(queryset, selected, categories, search_query=''):
+    """
+    Counts for every facet value over `queryset` (the catalog before facet filters).
+    Cached until the next catalog change.
+    """
+    signature = '|'.join([
+        search_query,
+        selected['category'] or '',
+        selected['price'] or '',
+        ','.join(sorted(selected['sizes'])),
+    ])
+    digest = hashlib.md5(signature.encode()).hexdigest()
+    key = f"yksshop:facets:{get_version('catalog')}:{digest}"
+
+    counts = cache.get(key)
+    if counts is None:
+        counts = _count_facets(queryset, selected, categories)
+        cache.set(key, counts, local_max_age(FACET_CACHE_TIMEOUT))
+    return counts
+
+
+def build_facets(request, counts, selected, categories):
+    """
+    Template/API friendly facet groups. Each value carries its count, whether it
+    is selected, and the URL that toggles it while keeping the other filters.
+    """
+    def toggle_url(name, value, multi=False):
+        params = request.GET.copy()
+        params.pop('cursor', None)
+        if multi:
+            values = params.getlist(name)
+            if value in values:
+                values.remove(value)
+            else:
+                values.append(value)
+            params.setlist(name, values)
+        elif params.get(name) == value:
+            params.pop(name)
+        else:
+            params[name] = value
+        query = params.urlencode()
+        return f"{request.path}?{query}" if query else request.path
+
+    return [
+        {
+            'name': 'category',
+            'label': 'Category',
+            'values': [
+                {
+                    'value': category.slug,
+                    'label': category.name,
+                    'count': counts.get(f'category_{category.pk}', 0),
+                    'selected': selected['category'] == category.slug,
+                    'url': toggle_url('category', category.slug),
+                }
+                for category in categories
+            ],
+        },
+        {
+            'name': 'price',
+            'label': 'Price',
+            'values': [
+                {
+                    'value': key,
+                    'label': label,
+                    'count': counts.get(f'price_{index}', 0),
+                    'selected': selected['price'] == key,
+                    'url': toggle_url('price', key),
+                }
+                for index, (key, label, _, _) in enumerate(PRICE_BANDS)
+            ],
+        },
+        {
+            'name': 'size',
+            'label': 'Size in stock',
+            'values': [
+                {
+                    'value': size,
+                    'label': size,
+                    'count': counts.get(f'size_{size}', 0),
+                    'selected': size in selected['sizes'],
+                    'url': toggle_url('size', size, multi=True),
+                }
+                for size in SIZES
+            ],
+        },
+    ]
@@ -0,0 +1,176 @@
+"""
+Guest cart for anonymous visitors
+Lines live in a signed cookie ("product.size.quantity" triples), so browsing and
+adding to cart before login never writes to the database. On login the lines are
+merged into the user's persistent Cart in one bulk write.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from .cart_view import product_prefetches
+from .models import Cart, CartItem, Product, ProductVariant
+
+COOKIE_NAME = 'guest_cart'
+COOKIE_SALT = 'yksshop.guest_cart'
+COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+MAX_LINES = 30
+
+# Index 0 is "no size"; the rest follow ProductVariant.Sizes
+SIZE_CODES = [None] + [size for size, _ in ProductVariant.Sizes.choices]
+
+
+def has_guest_cart(request):
+    """True if the request carries a guest cart cookie (its pages show a cart badge)"""
+    return COOKIE_NAME in request.COOKIES
+
+
+def line_id(product_id, size):
+    """Numeric id for a guest line, so templates/JS can treat it like a CartItem id"""
+    return product_id * 10 + SIZE_CODES.index(size)
+
+
+def parse_line_id(value):
+    """
+    Returns:
+        tuple: (product_id, size), or None if `value` is not a valid line id
+    """
+    try:
+        value = int(value)
+        size_code = value % 10
+        return value // 10, SIZE_CODES[size_code]
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class GuestCart:
+    def __init__(self, lines=None):
+        # {(product_id, size): quantity}, in insertion order
+        self.lines = dict(lines or {})
+        self._items = None
+
+    @classmethod
+    def from_request(cls, request):
+        raw = request.get_signed_cookie(COOKIE_NAME, default='', salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE)
+        lines = {}
+        for chunk in raw.split(','):
+            try:
+                product_id, size_code, quantity = (int(part) for part in chunk.split('.'))
+                size = SIZE_CODES[size_code]
+            except (ValueError, IndexError):
+                continue
+            if quantity > 0:
+                lines[(product_id, size)] = quantity
+        return cls(lines)
+
+    def encode(self):
+        return ','.join(
+            f"{product_id}.{SIZE_CODES.index(size)}.{quantity}"
+            for (product_id, size), quantity in self.lines.items()
+        )
+
+    def save(self, response):
+        """Write the cart to `response` (or expire the cookie when empty)"""
+        if not self.lines:
+            self.clear_cookie(response)
+            return
+        response.set_signed_cookie(
+            COOKIE_NAME,
+            self.encode(),
+            salt=COOKIE_SALT,
+            max_age=COOKIE_MAX_AGE,
+            httponly=True,
+            samesite='Lax',
+            secure=settings.SESSION_COOKIE_SECURE,
+        )
+
+    @staticmethod
+    def clear_cookie(response):
+        response.delete_cookie(COOKIE_NAME, samesite='Lax')
+
+    def get_quantity(self, product_id, size):
+        return self.lines.get((product_id, size), 0)
+
+    def set_quantity(self, product_id, size, quantity):
+        """Set a line's quantity; zero or less removes it. Returns False if the cart is full."""
+        key = (product_id, size)
+        if quantity <= 0:
+            self.lines.pop(key, None)
+        elif key in self.lines or len(self.lines) < MAX_LINES:
+            self.lines[key] = quantity
+        else:
+            return False
+        self._items = None
+        return True
+
+    def get_items(self):
+        """
+        Unsaved CartItem objects for the lines, with products, variants and images
+        loaded in three queries. Lines whose product is gone or unavailable are dropped.
+        """
+        if self._items is None:
+            products = Product.objects.filter(
+                pk__in={product_id for product_id, _ in self.lines},
+                is_available=True,
+            ).prefetch_related(*product_prefetches()).in_bulk()
+            self._items = []
+            for (product_id, size), quantity in self.lines.items():
+                product = products.get(product_id)
+                if product is None:
+                    continue
+                item = CartItem(product=product, quantity=quantity, size=size)
+                item.id = line_id(product_id, size)
+                self._items.append(item)
+        return self._items
+
+    def get_item_count(self):
+        return sum(self.lines.values())
+
+    def get_total(self):
+        return sum(item.get_total() for item in self.get_items())
+
+
+def merge_guest_cart(request, user):
+    """
+    Fold the request's guest cart into `user`'s Cart: one read of the existing lines,
+    one bulk_update, one bulk_create and one counter reconcile, in a single transaction.
+    Quantities are capped at available stock.
+
+    Returns:
+        bool: True if there was a guest cart to merge (the caller should clear the cookie)
+    """
+    guest = GuestCart.from_request(request)
+    if not guest.lines:
+        return False
+
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(user=user)
+        existing = {
+            (item.product_id, item.size): item
+            for item in CartItem.objects.filter(cart=cart)
+        }
+
+        to_create, to_update = [], []
+        for guest_item in guest.get_items():
+            product = guest_item.product
+            if product.has_size_variants and not guest_item.size:
+                continue
+            available_stock = product.get_stock_for_size(guest_item.size)
+
+            item = existing.get((product.pk, guest_item.size))
+            if item is None:
+                quantity = min(guest_item.quantity, available_stock)
+                if quantity > 0:
+                    to_create.append(CartItem(cart=cart, product=product, size=guest_item.size, quantity=quantity))
+            else:
+                quantity = min(item.quantity + guest_item.quantity, available_stock)
+                if quantity != item.quantity:
+                    item.quantity = quantity
+                    to_update.append(item)
+
+        if to_update:
+            CartItem.objects.bulk_update(to_update, ['quantity'])
+        if to_create:
+            CartItem.objects.bulk_create(to_create)
+        Cart.objects.filter(pk=cart.pk).reconcile()
+
+    return True
@@ -0,0 +1,114 @@
+"""
+Idempotency keys for non-repeatable POST endpoints
+A client sends `Idempotency-Key: <random string>` with a request. The first
+response for (user, view, key) is stored compressed in the cache; a retry with
+the same key gets that stored response back without running the view again.
+Concurrent duplicates are serialized with a cache lock: the second request
+waits briefly for the first to finish, then replays its response.
+
+Only final answers are stored: 2xx, and 4xx other than the "try again"
+statuses. A 5xx (views answer unexpected errors with one) is not, so a retry
+runs the view again instead of replaying a transient failure for the key's TTL.
+"""
+import hashlib
+import time
+import zlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+LOCK_TIMEOUT = 60
+WAIT_TIMEOUT = 10
+WAIT_INTERVAL = 0.1
+# 4xx responses that say "try again later" rather than "this request is wrong"
+RETRYABLE_CLIENT_ERRORS = {408, 409, 425, 429}
+
+
+def _request_fingerprint(request):
+    """Hash of the submitted fields (not the raw body: multipart boundaries vary per send)"""
+    fields = sorted((name, tuple(request.POST.getlist(name))) for name in request.POST)
+    return hashlib.sha256(repr(fields).encode()).hexdigest()
+
+
+def _cache_keys(request, view_name, key):
+    digest = hashlib.sha256(f"{request.user.pk}:{view_name}:{key}".encode()).hexdigest()
+    return f"yksshop:idempotency:{digest}", f"yksshop:idempotency:lock:{digest}"
+
+
+def _is_final(response):
+    status = response.status_code
+    if response.streaming:
+        return False
+    return 200 <= status < 300 or (400 <= status < 500 and status not in RETRYABLE_CLIENT_ERRORS)
+
+
+def _replay(stored, fingerprint):
+    stored_fingerprint, status, content_type, content = stored
+    if stored_fingerprint != fingerprint:
+        return JsonResponse(
+            {'success': False, 'message': 'Idempotency key was already used for a different request'},
+            status=422,
+        )
+    response = HttpResponse(zlib.decompress(content), status=status, content_type=content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view_func):
+    """
+    Make a POST view safe to retry when the client sends an Idempotency-Key header.
+    Requests without the header run as before. Stored responses expire after
+    settings.IDEMPOTENCY_KEY_TTL seconds (default 24 hours); server errors and
+    retryable 4xx responses are not stored.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER, '').strip()
+        if not key:
+            return view_func(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({'success': False, 'message': 'Idempotency key is too long'}, status=400)
+
+        fingerprint = _request_fingerprint(request)
+        response_key, lock_key = _cache_keys(request, view_func.__name__, key)
+
+        stored = cache.get(response_key)
+        if stored is not None:
+            return _replay(stored, fingerprint)
+
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while not cache.add(lock_key, 1, LOCK_TIMEOUT):
+            # Another request with this key is running; wait for its response
+            time.sleep(WAIT_INTERVAL)
+            stored = cache.get(response_key)
+            if stored is not None:
+                return _replay(stored, fingerprint)
+            if time.monotonic() > deadline:
+                return JsonResponse(
+                    {'success': False, 'message': 'A request with this idempotency key is still in progress'},
+                    status=409,
+                )
+
+        try:
+            # The holder of the lock may have finished between our get() and add()
+            stored = cache.get(response_key)
+            if stored is not None:
+                return _replay(stored, fingerprint)
+
+            response = view_func(request, *args, **kwargs)
+            if _is_final(response):
+                ttl = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 60 * 60 * 24)
+                cache.set(
+                    response_key,
+                    (fingerprint, response.status_code, response['Content-Type'], zlib.compress(response.content)),
+                    ttl,
+                )
+            return response
+        finally:
+            cache.delete(lock_key)
+
+    return wrapper
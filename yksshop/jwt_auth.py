@@ -0,0 +1,121 @@
+"""
+Cached JWT authentication
+Bearer requests are validated once: JWTAuthenticationMiddleware authenticates
+the token and leaves the result on the request, and CachedJWTAuthentication
+(DRF's authentication class) reuses it instead of decoding the token again.
+
+Users are looked up through a small per-process LRU keyed by user id, so API
+and mobile traffic doesn't query auth_user on every request. Entries expire
+after JWT_USER_CACHE_TTL seconds; saving or deleting a user drops the entry
+here and bumps the user's version stamp (see versioning.py), so other
+processes drop theirs on the next request.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .versioning import bump_version, get_version
+
+# Attribute on the Django HttpRequest holding the middleware's (user, token)
+REQUEST_ATTR = '_jwt_auth'
+
+
+def _namespace(user_id):
+    return f'user:{user_id}'
+
+
+class UserCache:
+    """LRU of user objects by id; entries expire after `ttl` seconds"""
+
+    def __init__(self, maxsize=1024, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, version, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        if version != get_version(_namespace(key)):
+            # Saved in another process since we cached it
+            self.invalidate(key)
+            return None
+        # A copy, so one request's cached relations don't leak into the next
+        return copy.copy(user)
+
+    def set(self, user_id, user):
+        key = str(user_id)
+        version = get_version(_namespace(key))
+        with self._lock:
+            self._entries[key] = (copy.copy(user), version, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache(
+    maxsize=getattr(settings, 'JWT_USER_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'JWT_USER_CACHE_TTL', 30),
+)
+
+
+def invalidate_user(user_id):
+    """Forget a saved/deleted user here and in every other process"""
+    user_cache.invalidate(user_id)
+    bump_version(_namespace(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        # DRF wraps the HttpRequest the middleware already authenticated
+        shared = getattr(getattr(request, '_request', request), REQUEST_ATTR, None)
+        if shared is not None:
+            return shared
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        user = user_cache.get(user_id)
+        if user is None:
+            # Runs the active / revoked-token checks too
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user)
+            return user
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
+
+
+jwt_authentication = CachedJWTAuthentication()
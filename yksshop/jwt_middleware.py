@@ -2,11 +2,11 @@
 JWT Authentication Middleware for Django Views
 Allows JWT tokens to be used for authentication in traditional Django views
 """
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
 from django.utils.deprecation import MiddlewareMixin
 
+from .jwt_auth import REQUEST_ATTR, jwt_authentication
+
 
 class JWTAuthenticationMiddleware(MiddlewareMixin):
     """
@@ -20,30 +20,17 @@ class JWTAuthenticationMiddleware(MiddlewareMixin):
         if hasattr(request, 'user') and request.user.is_authenticated:
             return None
         
-        # Get token from Authorization header
-        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-        
-        if not auth_header.startswith('Bearer '):
-            return None
-        
-        # Extract token
-        token = auth_header.split(' ')[1] if len(auth_header.split(' ')) > 1 else None
-        
-        if not token:
-            return None
-        
-        # Authenticate using JWT
-        jwt_auth = JWTAuthentication()
+        # Validate the Bearer token once; DRF views reuse the result (see jwt_auth.py)
         try:
-            validated_token = jwt_auth.get_validated_token(token)
-            user = jwt_auth.get_user(validated_token)
-            request.user = user
-        except (InvalidToken, TokenError):
+            result = jwt_authentication.authenticate(request)
+        except (InvalidToken, TokenError, AuthenticationFailed):
             # Token is invalid, leave user as anonymous
-            pass
+            return None
         except Exception:
             # Any other error, leave user as anonymous
-            pass
-        
-        return None
+            return None
 
+        if result is not None:
+            request.user = result[0]
+            setattr(request, REQUEST_ATTR, result)
+        return None
@@ -10,6 +10,9 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
+from .guest_cart import GuestCart, merge_guest_cart
+from .orders import ORDER_PAGE_SIZE, order_history, serialize_order
+from .pagination import get_page_size, paginate_keyset
 
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -100,11 +103,14 @@ def jwt_login(request):
             status=status.HTTP_401_UNAUTHORIZED
         )
     
+    # Fold any anonymous cart from this client into the user's cart
+    guest_cart_merged = merge_guest_cart(request, user)
+    
     # Generate tokens using serializer
     serializer = CustomTokenObtainPairSerializer()
     token = serializer.get_token(user)
     
-    return Response({
+    response = Response({
         'access': str(token.access_token),
         'refresh': str(token),
         'user': {
@@ -116,6 +122,9 @@ def jwt_login(request):
             'is_staff': user.is_staff,
         }
     }, status=status.HTTP_200_OK)
+    if guest_cart_merged:
+        GuestCart.clear_cookie(response)
+    return response
 
 
 @api_view(['GET'])
@@ -135,3 +144,20 @@ def jwt_user_info(request):
         'is_active': user.is_active,
     }, status=status.HTTP_200_OK)
 
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def api_order_list(request):
+    """
+    Current user's order history, newest first: ?cursor=&page_size=
+    """
+    orders, next_cursor = paginate_keyset(
+        order_history(request.user),
+        cursor=request.query_params.get('cursor'),
+        page_size=get_page_size(request, default=ORDER_PAGE_SIZE),
+    )
+    return Response({
+        'results': [serialize_order(order) for order in orders],
+        'next_cursor': next_cursor,
+    }, status=status.HTTP_200_OK)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from yksshop.search import get_backend, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text product search index from scratch in one bulk statement."
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        if backend.vendor is None:
+            self.stdout.write(
+                self.style.WARNING(
+                    "This database has no full-text backend; search falls back to icontains."
+                )
+            )
+            return
+
+        with transaction.atomic():
+            indexed = rebuild_index()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Indexed {indexed} product(s) using the {backend.vendor} backend.")
+        )
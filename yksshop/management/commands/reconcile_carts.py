@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from yksshop.models import Cart
+
+
+class Command(BaseCommand):
+    help = (
+        "Repairs drift in the denormalized cart item counts and totals by recomputing "
+        "them from the cart lines."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report carts whose counters have drifted.',
+        )
+
+    def handle(self, *args, **options):
+        drifted_ids = list(Cart.objects.drifted().values_list('pk', flat=True))
+
+        if options['dry_run']:
+            self.stdout.write(f"{len(drifted_ids)} cart(s) have drifted.")
+            return
+
+        repaired = Cart.objects.filter(pk__in=drifted_ids).reconcile()
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {repaired} cart(s)."))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from yksshop.outbox import process_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Delivers queued order notifications (email/WhatsApp) from the outbox, "
+        "retrying failures with exponential backoff."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the due messages once and exit.')
+        parser.add_argument('--batch-size', type=int, default=50, help='Messages claimed per batch (default 50).')
+        parser.add_argument('--workers', type=int, default=4, help='Delivery threads (default 4).')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when idle (default 5).')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Notification worker started.")
+        try:
+            while True:
+                processed, delivered = process_batch(options['batch_size'], options['workers'])
+                if processed:
+                    self.stdout.write(f"Delivered {delivered}/{processed} notification(s).")
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS("Notification worker stopped."))
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE IF NOT EXISTS yksshop_product_search ("
+            "product_id bigint PRIMARY KEY REFERENCES yksshop_product (id) "
+            "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS yksshop_product_search_document_gin "
+            "ON yksshop_product_search USING GIN (document)"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS yksshop_product_fts "
+            "USING fts5(name, category, description, tokenize='porter unicode61')"
+        )
+    else:
+        return
+
+    from yksshop.search import rebuild_index
+    rebuild_index()
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS yksshop_product_search")
+    elif vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS yksshop_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yksshop', '0012_product_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.1 on 2026-10-16 22:33
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_cart_totals(apps, schema_editor):
+    Cart = apps.get_model('yksshop', 'Cart')
+    CartItem = apps.get_model('yksshop', 'CartItem')
+
+    lines = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    item_count = lines.annotate(value=Sum('quantity')).values('value')
+    total = lines.annotate(
+        value=Sum(
+            F('quantity') * F('product__price'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        )
+    ).values('value')
+    Cart.objects.update(
+        item_count=Coalesce(Subquery(item_count), 0),
+        total=Coalesce(Subquery(total), Value(Decimal('0.00'))),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yksshop', '0014_variant_image_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_cart_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.1 on 2026-10-16 22:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yksshop', '0018_stocksubscription'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='outboxmessage',
+            name='kind',
+            field=models.CharField(choices=[('order_confirmation', 'Order confirmation'), ('order_status_update', 'Order status update'), ('back_in_stock', 'Back in stock fan-out'), ('order_digest', 'Order status digest')], max_length=40),
+        ),
+    ]
@@ -1,4 +1,8 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Exists, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -6,6 +10,60 @@ from django.utils import timezone
 from django.contrib.auth.hashers import make_password, check_password
 from cloudinary.models import CloudinaryField
 
+from .order_numbers import new_order_number
+
+
+class FieldTrackerMixin:
+    """
+    Remembers the values of `tracked_fields` as loaded from (or last saved to) the
+    database, so save signals can tell what changed without re-reading the row.
+    post_save handlers still see the pre-save values; the snapshot moves on after save().
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_tracked_fields()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._snapshot_tracked_fields()
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        # Also runs when a deferred field is first read: what it loads is the saved value
+        refreshed = self.tracked_fields if fields is None else [f for f in fields if f in self.tracked_fields]
+        snapshot = getattr(self, '_tracked_snapshot', {})
+        snapshot.update((field, self.__dict__[field]) for field in refreshed if field in self.__dict__)
+        self._tracked_snapshot = snapshot
+
+    def _snapshot_tracked_fields(self):
+        # Deferred fields are absent from __dict__; their previous value stays unknown
+        self._tracked_snapshot = {
+            field: self.__dict__[field] for field in self.tracked_fields if field in self.__dict__
+        }
+
+    def previous(self, field):
+        """Value of `field` when loaded/last saved, or None if unknown (unsaved or deferred)"""
+        return getattr(self, '_tracked_snapshot', {}).get(field)
+
+    def has_changed(self, field):
+        """
+        True if `field` differs from its saved value. A field whose saved value is
+        unknown counts as changed once it has been set; a deferred field that was
+        never loaded or set hasn't changed.
+        """
+        snapshot = getattr(self, '_tracked_snapshot', {})
+        if field not in snapshot:
+            return field in self.__dict__
+        return snapshot[field] != getattr(self, field)
+
+    def changed_fields(self):
+        """The tracked fields that differ from their saved values"""
+        return {field for field in self.tracked_fields if self.has_changed(field)}
+
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -57,7 +115,40 @@ class Category(models.Model):
         return self.name
 
 
-class Product(models.Model):
+PLACEHOLDER_IMAGE_URL = 'https://via.placeholder.com/400x400?text=No+Image'
+
+
+class ProductQuerySet(models.QuerySet):
+    def on_display(self):
+        """
+        Products with a page: the available ones, plus sold-out ones (checkout
+        marks a product unavailable when it sells out) so shoppers can still
+        ask to be told when they're back.
+        """
+        return self.filter(Q(is_available=True) | Q(stock=0))
+
+    def for_listing(self):
+        """
+        Annotate the variant flag, variant stock and primary gallery image so
+        product grids can render every card without per-product queries.
+        """
+        variants = ProductVariant.objects.filter(product=OuterRef('pk'))
+        variant_stock = variants.order_by().values('product').annotate(
+            total=Sum('stock')
+        ).values('total')
+        first_image = ProductImage.objects.filter(
+            product=OuterRef('pk'),
+            image__isnull=False,
+        ).exclude(image='').order_by('pk').values('image')[:1]
+
+        return self.annotate(
+            listing_has_variants=Exists(variants),
+            listing_variant_stock=Coalesce(Subquery(variant_stock), 0),
+            listing_image=Subquery(first_image),
+        )
+
+
+class Product(FieldTrackerMixin, models.Model):
     name = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     description = models.TextField()
@@ -69,16 +160,40 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    # Restock and price-change detection in signals.py
+    tracked_fields = ('stock', 'price')
+
+    class Meta:
+        indexes = [
+            # Keyset pagination order used by the catalog (see pagination.py)
+            models.Index(fields=['-created_at', '-id'], name='product_created_id_idx'),
+        ]
+
+    def _prefetched(self, name):
+        return getattr(self, '_prefetched_objects_cache', {}).get(name)
+
     @property
     def get_image_url(self):
         if self.image:
             return self.image.url
 
-        related_image = self.images.filter(image__isnull=False).first()
+        # Annotated by ProductQuerySet.for_listing()
+        if hasattr(self, 'listing_image'):
+            if self.listing_image:
+                return self.listing_image.url
+            return PLACEHOLDER_IMAGE_URL
+
+        prefetched = self._prefetched('images')
+        if prefetched is not None:
+            related_image = next((img for img in prefetched if img.image), None)
+        else:
+            related_image = self.images.filter(image__isnull=False).first()
         if related_image and related_image.image:
             return related_image.image.url
 
-        return 'https://via.placeholder.com/400x400?text=No+Image'
+        return PLACEHOLDER_IMAGE_URL
 
     @property
     def gallery_images(self):
@@ -92,7 +207,7 @@ class Product(models.Model):
                 images.append(related_image.image.url)
 
         if not images:
-            images.append('https://via.placeholder.com/400x400?text=No+Image')
+            images.append(PLACEHOLDER_IMAGE_URL)
 
         # Ensure uniqueness while preserving order
         seen = set()
@@ -105,11 +220,19 @@ class Product(models.Model):
 
     @property
     def has_size_variants(self):
+        if hasattr(self, 'listing_has_variants'):
+            return self.listing_has_variants
+
+        prefetched = self._prefetched('variants')
+        if prefetched is not None:
+            return len(prefetched) > 0
         return self.variants.exists()
 
     @property
     def total_stock(self):
         if self.has_size_variants:
+            if hasattr(self, 'listing_variant_stock'):
+                return self.listing_variant_stock
             return sum(variant.stock for variant in self.variants.all())
         return self.stock
 
@@ -117,6 +240,10 @@ class Product(models.Model):
         if not size:
             return self.total_stock
 
+        prefetched = self._prefetched('variants')
+        if prefetched is not None:
+            return next((variant.stock for variant in prefetched if variant.size == size), 0)
+
         try:
             variant = self.variants.get(size=size)
             return variant.stock
@@ -124,7 +251,7 @@ class Product(models.Model):
             return 0
 
 
-class ProductVariant(models.Model):
+class ProductVariant(FieldTrackerMixin, models.Model):
     class Sizes(models.TextChoices):
         XS = 'XS', 'XS'
         S = 'S', 'S'
@@ -136,6 +263,9 @@ class ProductVariant(models.Model):
     product = models.ForeignKey(Product, related_name='variants', on_delete=models.CASCADE)
     size = models.CharField(max_length=10, choices=Sizes.choices)
     stock = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    tracked_fields = ('stock',)
 
     class Meta:
         unique_together = ('product', 'size')
@@ -148,25 +278,82 @@ class ProductVariant(models.Model):
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
     image = CloudinaryField('image', blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Image for {self.product.name}"
 
 
 
+class CartQuerySet(models.QuerySet):
+    def _actual_totals(self):
+        """Subquery expressions computing item_count/total from the cart lines"""
+        lines = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        item_count = lines.annotate(value=Sum('quantity')).values('value')
+        total = lines.annotate(
+            value=Sum(
+                F('quantity') * F('product__price'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            )
+        ).values('value')
+        return {
+            'item_count': Coalesce(Subquery(item_count), 0),
+            'total': Coalesce(Subquery(total), Value(Decimal('0.00'))),
+        }
+
+    def drifted(self):
+        """Carts whose denormalized counters disagree with their lines"""
+        actual = self._actual_totals()
+        return self.annotate(
+            actual_item_count=actual['item_count'],
+            actual_total=actual['total'],
+        ).exclude(item_count=F('actual_item_count'), total=F('actual_total'))
+
+    def reconcile(self):
+        """
+        Recompute the denormalized item_count/total from the cart lines in one UPDATE.
+        Returns the number of carts updated.
+        """
+        return self.update(**self._actual_totals(), updated_at=timezone.now())
+
+
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
+    # Denormalized from the cart lines; kept in step by adjust_totals()/reconcile()
+    item_count = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartQuerySet.as_manager()
+
     def __str__(self):
         return f"Cart of {self.user.username}"
 
     def get_total(self):
-        return sum(item.get_total() for item in self.items.all())
+        return self.total
 
     def get_item_count(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.item_count
+
+    def adjust_totals(self, quantity_delta, amount_delta):
+        """
+        Atomically shift the denormalized counters with F() expressions.
+        Call inside the same transaction as the cart line change.
+        """
+        Cart.objects.filter(pk=self.pk).update(
+            item_count=F('item_count') + quantity_delta,
+            total=F('total') + amount_delta,
+            updated_at=timezone.now(),
+        )
+        self.refresh_from_db(fields=['item_count', 'total', 'updated_at'])
+
+    def clear(self):
+        """Delete every line and zero the counters"""
+        self.items.all().delete()
+        Cart.objects.filter(pk=self.pk).update(item_count=0, total=0, updated_at=timezone.now())
+        self.item_count = 0
+        self.total = Decimal('0.00')
 
 
 class CartItem(models.Model):
@@ -224,7 +411,7 @@ class HomeHero(models.Model):
             )
 
 
-class Order(models.Model):
+class Order(FieldTrackerMixin, models.Model):
     PAYMENT_CHOICES = [
         ('online', 'Online Payment'),
         ('cod', 'Cash on Delivery'),
@@ -266,13 +453,21 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Status-change notifications in signals.py
+    tracked_fields = ('status',)
+
+    class Meta:
+        indexes = [
+            # Order history: a user's orders, newest first (keyset paginated)
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.order_number} by {self.user.username}"
 
     def save(self, *args, **kwargs):
         if not self.order_number:
-            import random, string
-            self.order_number = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+            self.order_number = new_order_number()
         super().save(*args, **kwargs)
 
 
@@ -290,3 +485,74 @@ class OrderItem(models.Model):
 
     def get_total(self):
         return self.price * self.quantity
+
+
+class StockSubscription(models.Model):
+    """A request to be told when a product (optionally one size of it) is back in stock"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_subscriptions')
+    size = models.CharField(max_length=10, blank=True, null=True, help_text="Empty means any size")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='stock_subscriptions')
+    email = models.EmailField(blank=True)
+    phone = models.CharField(max_length=20, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    notified_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Fan-out scan: a product's subscribers still waiting, in pk order
+            models.Index(fields=['product', 'notified_at', 'id'], name='stock_sub_pending_idx'),
+        ]
+
+    def __str__(self):
+        who = self.email or self.phone or (self.user and self.user.username)
+        if self.size:
+            return f"{who} - {self.product.name} ({self.size})"
+        return f"{who} - {self.product.name}"
+
+
+class OutboxMessage(models.Model):
+    """
+    A notification waiting to be delivered. Rows are written in the same
+    transaction as the change that caused them and drained by
+    `manage.py run_notification_worker`, so requests never wait on SMTP/Twilio.
+    """
+    class Kinds(models.TextChoices):
+        ORDER_CONFIRMATION = 'order_confirmation', 'Order confirmation'
+        ORDER_STATUS_UPDATE = 'order_status_update', 'Order status update'
+        BACK_IN_STOCK = 'back_in_stock', 'Back in stock fan-out'
+        # One customer's status changes for the day, across all their orders
+        ORDER_DIGEST = 'order_digest', 'Order status digest'
+
+    class Channels(models.TextChoices):
+        EMAIL = 'email', 'Email'
+        WHATSAPP = 'whatsapp', 'WhatsApp'
+        # One job that notifies every subscriber over all channels
+        FANOUT = 'fanout', 'Fan-out'
+
+    class Statuses(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        SENDING = 'sending', 'Sending'
+        SENT = 'sent', 'Sent'
+        FAILED = 'failed', 'Failed'
+
+    kind = models.CharField(max_length=40, choices=Kinds.choices)
+    channel = models.CharField(max_length=20, choices=Channels.choices)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True, related_name='notifications')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='notifications')
+    payload = models.JSONField(default=dict, blank=True)
+
+    status = models.CharField(max_length=20, choices=Statuses.choices, default=Statuses.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker's claim query: due messages in pending/sending
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} ({self.channel}) - {self.status}"
@@ -4,12 +4,20 @@ Notification system for YKS Men's Wear
 Handles Email and WhatsApp notifications for orders and products
 """
 import os
-import requests
+import smtplib
+import time
+
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 
+from .models import Order
+from .whatsapp import get_whatsapp_client
+
+CHANNELS = ('email', 'whatsapp')
+STATUS_LABELS = dict(Order.STATUS_CHOICES)
+
 
 def get_site_url():
     """Get the site URL for email links"""
@@ -21,6 +29,34 @@ def get_site_url():
     return 'http://localhost:8000'
 
 
+def build_email(subject, template_name, context, recipient_email):
+    """Render an HTML email (with a plain-text alternative) without sending it"""
+    html_content = render_to_string(f'shop/emails/{template_name}.html', context)
+    text_content = strip_tags(html_content)  # Plain text version
+
+    msg = EmailMultiAlternatives(
+        subject=subject,
+        body=text_content,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[recipient_email]
+    )
+    msg.attach_alternative(html_content, 'text/html')
+    return msg
+
+
+def send_email(msg, fail_silently=False):
+    """Send a built email; returns True on success, logs and returns False on error"""
+    try:
+        msg.send(fail_silently=fail_silently)
+        return True
+    except Exception as e:
+        # Log error but don't raise to prevent worker crashes
+        print(f"Error sending email to {', '.join(msg.to)}: {e}")
+        import traceback
+        print(traceback.format_exc())
+        return False
+
+
 def send_email_notification(subject, template_name, context, recipient_email, recipient_name=None, fail_silently=True):
     """
     Send email notification to user
@@ -34,33 +70,102 @@ def send_email_notification(subject, template_name, context, recipient_email, re
         fail_silently: If True, don't raise exceptions (default: True to prevent worker timeouts)
     """
     try:
-        # Render HTML email
-        html_content = render_to_string(f'shop/emails/{template_name}.html', context)
-        text_content = strip_tags(html_content)  # Plain text version
-        
-        # Create email with fail_silently to prevent worker timeouts
-        msg = EmailMultiAlternatives(
-            subject=subject,
-            body=text_content,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[recipient_email]
-        )
-        msg.attach_alternative(html_content, 'text/html')
-        # Use fail_silently=True to prevent blocking the request if SMTP times out
-        msg.send(fail_silently=fail_silently)
-        
-        return True
+        msg = build_email(subject, template_name, context, recipient_email)
     except Exception as e:
-        # Log error but don't raise to prevent worker crashes
-        print(f"Error sending email to {recipient_email}: {e}")
-        import traceback
-        print(traceback.format_exc())
+        print(f"Error rendering email for {recipient_email}: {e}")
         return False
+    return send_email(msg, fail_silently=fail_silently)
+
+
+class BatchMailer:
+    """
+    Sends many emails over one SMTP connection instead of one connection (and
+    TLS handshake) per message. Queued messages are flushed when the batch
+    reaches `max_batch` messages or its oldest message is `max_delay` seconds
+    old, and on close. A dropped connection is reopened and the message retried
+    once. Each message's outcome is passed to `on_result(key, ok, error)`.
+
+    Usage:
+        with BatchMailer(on_result=record) as mailer:
+            for key, msg in pending:
+                mailer.add(msg, key)
+    """
+    RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+    def __init__(self, max_batch=50, max_delay=5.0, on_result=None, connection=None):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.on_result = on_result
+        self._connection = connection
+        self._queue = []
+        self._oldest = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, msg, key=None):
+        if not self._queue:
+            self._oldest = time.monotonic()
+        self._queue.append((key, msg))
+        if len(self._queue) >= self.max_batch or time.monotonic() - self._oldest >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        """
+        Send everything queued.
+
+        Returns:
+            list: (key, ok, error) per message
+        """
+        queue, self._queue = self._queue, []
+        results = []
+        if not queue:
+            return results
+
+        for key, msg in queue:
+            ok, error = self._send(msg)
+            if not ok:
+                print(f"Error sending email to {', '.join(msg.to)}: {error}")
+            results.append((key, ok, error))
+            if self.on_result:
+                self.on_result(key, ok, error)
+        return results
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _open(self):
+        if self._connection is None:
+            self._connection = get_connection(fail_silently=False)
+        self._connection.open()
+
+    def _send(self, msg):
+        error = ''
+        for _ in range(2):
+            try:
+                self._open()
+                sent = self._connection.send_messages([msg])
+                return bool(sent), ''
+            except self.RECONNECT_ERRORS as e:
+                # Server hung up (idle timeout, rate limit); reconnect and retry once
+                error = str(e) or e.__class__.__name__
+                self._connection.close()
+            except Exception as e:
+                return False, str(e) or e.__class__.__name__
+        return False, error
 
 
 def send_whatsapp_notification(phone_number, message):
     """
-    Send WhatsApp notification using Twilio API
+    Send WhatsApp notification using Twilio API (see whatsapp.WhatsAppClient)
     
     Args:
         phone_number: Phone number with country code (e.g., +919876543210)
@@ -75,60 +180,46 @@ def send_whatsapp_notification(phone_number, message):
             print("WhatsApp notifications are disabled")
             return False
         
-        # Get Twilio credentials from settings
-        account_sid = getattr(settings, 'TWILIO_ACCOUNT_SID', None)
-        auth_token = getattr(settings, 'TWILIO_AUTH_TOKEN', None)
-        whatsapp_from = getattr(settings, 'TWILIO_WHATSAPP_FROM', None)
-        
-        if not all([account_sid, auth_token, whatsapp_from]):
+        client = get_whatsapp_client()
+        if client is None:
             print("Twilio credentials not configured")
             return False
         
-        # Format phone number (ensure it starts with +)
-        if not phone_number.startswith('+'):
-            # Assume Indian number if no country code
-            if phone_number.startswith('0'):
-                phone_number = '+91' + phone_number[1:]
-            else:
-                phone_number = '+91' + phone_number
-        
-        # Twilio WhatsApp API endpoint
-        url = f"https://api.twilio.com/2010-04-01/Accounts/{account_sid}/Messages.json"
-        
-        # Prepare message
-        payload = {
-            'From': f'whatsapp:{whatsapp_from}',
-            'To': f'whatsapp:{phone_number}',
-            'Body': message
-        }
-        
-        # Send request
-        response = requests.post(
-            url,
-            auth=(account_sid, auth_token),
-            data=payload,
-            timeout=10
-        )
-        
-        if response.status_code == 201:
+        if client.send(phone_number, message):
             print(f"WhatsApp message sent successfully to {phone_number}")
             return True
-        else:
-            print(f"Error sending WhatsApp: {response.status_code} - {response.text}")
-            return False
+        return False
             
     except Exception as e:
         print(f"Error sending WhatsApp notification: {e}")
         return False
 
 
-def send_order_confirmation(order):
+def order_confirmation_email(order):
+    """The order confirmation email, or None if the customer has no email address"""
+    user = order.user
+    if not user.email:
+        return None
+
+    email_context = {
+        'order': order,
+        'user': user,
+        'order_items': order.items.all(),
+        'site_url': get_site_url(),
+    }
+    email_subject = f"Order Confirmation - #{order.order_number} | YKS Men's Wear"
+    return build_email(email_subject, 'order_confirmation', email_context, user.email)
+
+
+def send_order_confirmation(order, channels=CHANNELS):
     """
     Send order confirmation notification via email and WhatsApp
+
+    Returns:
+        dict: {channel: sent ok} for each channel that had a recipient
     """
+    results = {}
     user = order.user
-    recipient_email = user.email
-    recipient_name = user.get_full_name() or user.username
     
     # Get phone number from profile
     phone_number = None
@@ -138,24 +229,13 @@ def send_order_confirmation(order):
         pass
     
     # Email notification
-    email_context = {
-        'order': order,
-        'user': user,
-        'order_items': order.items.all(),
-        'site_url': get_site_url(),
-    }
-    
-    email_subject = f"Order Confirmation - #{order.order_number} | YKS Men's Wear"
-    send_email_notification(
-        email_subject,
-        'order_confirmation',
-        email_context,
-        recipient_email,
-        recipient_name
-    )
+    if 'email' in channels:
+        msg = order_confirmation_email(order)
+        if msg is not None:
+            results['email'] = send_email(msg)
     
     # WhatsApp notification
-    if phone_number:
+    if 'whatsapp' in channels and phone_number:
         whatsapp_message = (
             f"🎉 *Order Confirmed!*\n\n"
             f"Order #: {order.order_number}\n"
@@ -164,69 +244,149 @@ def send_order_confirmation(order):
             f"Status: {order.get_status_display()}\n\n"
             f"Thank you for shopping with YKS Men's Wear! 🙏"
         )
-        send_whatsapp_notification(phone_number, whatsapp_message)
+        results['whatsapp'] = send_whatsapp_notification(phone_number, whatsapp_message)
+    return results
+
 
+# Status messages
+STATUS_MESSAGES = {
+    'processing': 'Your order is being processed',
+    'shipped': 'Your order has been shipped!',
+    'delivered': 'Your order has been delivered!',
+    'cancelled': 'Your order has been cancelled',
+}
 
-def send_order_status_update(order, old_status=None):
+STATUS_EMOJI = {
+    'processing': '⏳',
+    'shipped': '🚚',
+    'delivered': '✅',
+    'cancelled': '❌',
+}
+
+
+def format_status_trail(trail):
+    """'Pending → Processing → Shipped' for a list of status values"""
+    return ' → '.join(STATUS_LABELS.get(status, status) for status in trail)
+
+
+def _profile_phone(user):
+    try:
+        return user.profile.phone
+    except Exception:
+        return None
+
+
+def order_status_update_email(order, old_status=None, trail=None):
     """
-    Send order status update notification
+    The status update email, or None if the customer has no email address.
+    `trail` lists every status the order went through since the last update
+    (coalesced changes); the email shows the final state and the trail.
     """
     user = order.user
-    recipient_email = user.email
-    recipient_name = user.get_full_name() or user.username
-    
-    # Get phone number
-    phone_number = None
-    try:
-        phone_number = user.profile.phone
-    except:
-        pass
-    
-    # Status messages
-    status_messages = {
-        'processing': 'Your order is being processed',
-        'shipped': 'Your order has been shipped!',
-        'delivered': 'Your order has been delivered!',
-        'cancelled': 'Your order has been cancelled',
-    }
-    
-    status_emoji = {
-        'processing': '⏳',
-        'shipped': '🚚',
-        'delivered': '✅',
-        'cancelled': '❌',
-    }
-    
-    # Email notification
+    if not user.email:
+        return None
+
     email_context = {
         'order': order,
         'user': user,
         'old_status': old_status,
-        'status_message': status_messages.get(order.status, 'Order status updated'),
+        'status_trail': format_status_trail(trail) if trail and len(trail) > 2 else '',
+        'status_message': STATUS_MESSAGES.get(order.status, 'Order status updated'),
         'site_url': get_site_url(),
     }
-    
     email_subject = f"Order #{order.order_number} Status Update - {order.get_status_display()} | YKS Men's Wear"
-    send_email_notification(
-        email_subject,
-        'order_status_update',
-        email_context,
-        recipient_email,
-        recipient_name
-    )
+    return build_email(email_subject, 'order_status_update', email_context, user.email)
+
+
+def send_order_status_update(order, old_status=None, channels=CHANNELS, trail=None):
+    """
+    Send order status update notification
+
+    Returns:
+        dict: {channel: sent ok} for each channel that had a recipient
+    """
+    results = {}
+    user = order.user
+    phone_number = _profile_phone(user)
+    
+    # Email notification
+    if 'email' in channels:
+        msg = order_status_update_email(order, old_status, trail)
+        if msg is not None:
+            results['email'] = send_email(msg)
     
     # WhatsApp notification
-    if phone_number:
-        emoji = status_emoji.get(order.status, '📦')
+    if 'whatsapp' in channels and phone_number:
+        emoji = STATUS_EMOJI.get(order.status, '📦')
+        trail_line = f"Updates: {format_status_trail(trail)}\n" if trail and len(trail) > 2 else ""
         whatsapp_message = (
             f"{emoji} *Order Status Update*\n\n"
             f"Order #: {order.order_number}\n"
             f"Status: {order.get_status_display()}\n"
+            f"{trail_line}"
             f"Total: Rs.{order.total_amount}\n\n"
-            f"{status_messages.get(order.status, 'Your order status has been updated')}\n\n"
+            f"{STATUS_MESSAGES.get(order.status, 'Your order status has been updated')}\n\n"
             f"Track your order: {get_site_url()}/order/{order.id}/"
         )
-        send_whatsapp_notification(phone_number, whatsapp_message)
+        results['whatsapp'] = send_whatsapp_notification(phone_number, whatsapp_message)
+    return results
+
+
+def order_digest_email(user, updates):
+    """
+    One email summarising the day's status changes across `user`'s orders,
+    or None if the customer has no email address.
+
+    Args:
+        updates: list of (order, trail) pairs
+    """
+    if not user.email:
+        return None
+
+    email_context = {
+        'user': user,
+        'updates': [
+            {
+                'order': order,
+                'status_trail': format_status_trail(trail),
+                'status_message': STATUS_MESSAGES.get(order.status, 'Order status updated'),
+            }
+            for order, trail in updates
+        ],
+        'site_url': get_site_url(),
+    }
+    count = len(updates)
+    email_subject = f"Your Order Updates ({count} order{'s' if count != 1 else ''}) | YKS Men's Wear"
+    return build_email(email_subject, 'order_digest', email_context, user.email)
+
+
+def send_order_digest(user, updates, channels=CHANNELS):
+    """
+    Send the daily order status digest
+
+    Returns:
+        dict: {channel: sent ok} for each channel that had a recipient
+    """
+    results = {}
+    phone_number = _profile_phone(user)
+
+    if 'email' in channels:
+        msg = order_digest_email(user, updates)
+        if msg is not None:
+            results['email'] = send_email(msg)
+
+    if 'whatsapp' in channels and phone_number:
+        lines = [
+            f"{STATUS_EMOJI.get(order.status, '📦')} #{order.order_number}: {format_status_trail(trail)}"
+            for order, trail in updates
+        ]
+        whatsapp_message = (
+            "📦 *Your Order Updates*\n\n"
+            + "\n".join(lines)
+            + f"\n\nTrack your orders: {get_site_url()}/orders/"
+        )
+        results['whatsapp'] = send_whatsapp_notification(phone_number, whatsapp_message)
+    return results
 
 
 def send_product_back_in_stock(product, user_email=None, user_phone=None):
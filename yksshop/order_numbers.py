@@ -0,0 +1,61 @@
+"""
+Order number allocation
+Order numbers are ULID-style identifiers: a 48-bit millisecond timestamp
+followed by 40 random bits, written in Crockford base32 (18 characters, no
+I/L/O/U). They sort by creation time as plain strings and are generated
+without touching the database.
+
+Within one process, a number issued in the same millisecond as the previous one
+adds a random step of 1 to 2**STEP_BITS to the random part. That keeps a worker
+monotonic and never repeating itself, while a neighbouring order's number is
+still one of ~16 million candidates rather than "previous + 1". Across workers
+a clash needs the same millisecond and the same 40 random bits.
+"""
+import secrets
+import threading
+import time
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+TIME_CHARS = 10
+RANDOM_BITS = 40
+RANDOM_CHARS = RANDOM_BITS // 5
+STEP_BITS = 24
+
+
+def _encode(value, length):
+    chars = []
+    for _ in range(length):
+        value, index = divmod(value, 32)
+        chars.append(ALPHABET[index])
+    return ''.join(reversed(chars))
+
+
+class OrderNumberAllocator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._last_random = 0
+
+    def allocate(self):
+        with self._lock:
+            now_ms = time.time_ns() // 1_000_000
+            if now_ms <= self._last_ms:
+                # Same (or a stepped-back) millisecond: stay monotonic
+                now_ms = self._last_ms
+                random_part = self._last_random + 1 + secrets.randbits(STEP_BITS)
+                if random_part >= 1 << RANDOM_BITS:
+                    now_ms += 1
+                    random_part = secrets.randbits(RANDOM_BITS - 1)
+            else:
+                # Leave headroom so same-millisecond increments don't overflow
+                random_part = secrets.randbits(RANDOM_BITS - 1)
+            self._last_ms = now_ms
+            self._last_random = random_part
+        return _encode(now_ms, TIME_CHARS) + _encode(random_part, RANDOM_CHARS)
+
+
+order_numbers = OrderNumberAllocator()
+
+
+def new_order_number():
+    return order_numbers.allocate()
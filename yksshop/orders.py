@@ -0,0 +1,182 @@
+"""
+Order placement and order history
+Turns a user's cart into an Order in a single transaction. Stock is taken with
+conditional F() decrements (`... SET stock = stock - n WHERE stock >= n`), so two
+concurrent checkouts can never both take the last unit: the second UPDATE
+matches no row and the whole order rolls back. Rows are touched in a fixed
+(product, size) order so concurrent orders lock them in the same order.
+
+Bulk status changes (the admin's "mark shipped" actions) read the old statuses
+in one pass, write the new one with a single UPDATE and queue the
+notifications as one outbox batch, instead of saving orders one at a time.
+
+Order history pages are keyset paginated over the (user, -created_at, -id)
+index with the lines prefetched, so a customer's 500th order costs the same as
+their first.
+"""
+from django.db import transaction
+from django.db.models import F, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .cart_view import cart_items_for_display
+from .models import Cart, Order, OrderItem, Product, ProductImage, ProductVariant
+from .outbox import StatusChange, enqueue_status_changes
+from .versioning import bump_version
+
+ORDER_PAGE_SIZE = 10
+
+
+class OrderError(Exception):
+    pass
+
+
+def _take_stock(item, now):
+    """Decrement stock for one cart line; returns False if there is not enough left"""
+    product = item.product
+    if product.has_size_variants and item.size:
+        updated = ProductVariant.objects.filter(
+            product_id=product.pk, size=item.size, stock__gte=item.quantity,
+        ).update(stock=F('stock') - item.quantity, updated_at=now)
+    else:
+        updated = Product.objects.filter(
+            pk=product.pk, stock__gte=item.quantity,
+        ).update(stock=F('stock') - item.quantity, updated_at=now)
+    return updated == 1
+
+
+def _recompute_product_stock(product_ids, now):
+    """Re-derive Product.stock from the variants, once per affected product"""
+    variant_stock = (
+        ProductVariant.objects.filter(product=OuterRef('pk'))
+        .order_by().values('product')
+        .annotate(total=Sum('stock')).values('total')
+    )
+    Product.objects.filter(pk__in=product_ids).update(
+        stock=Coalesce(Subquery(variant_stock), 0), updated_at=now,
+    )
+
+
+def place_order_from_cart(user, payment_method, shipping):
+    """
+    Create an Order from `user`'s cart, take the stock and empty the cart.
+
+    Args:
+        shipping: dict of the Order.shipping_* fields
+
+    Returns:
+        Order
+
+    Raises:
+        OrderError: the cart is empty or a line is out of stock (nothing is written)
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        cart, _ = Cart.objects.select_for_update().get_or_create(user=user)
+        items = sorted(cart_items_for_display(cart), key=lambda item: (item.product_id, item.size or ''))
+        if not items:
+            raise OrderError('Your cart is empty')
+
+        variant_products = set()
+        for item in items:
+            if not _take_stock(item, now):
+                if item.size:
+                    raise OrderError(f'Insufficient stock for {item.product.name} (Size {item.size})')
+                raise OrderError(f'Insufficient stock for {item.product.name}')
+            if item.product.has_size_variants and item.size:
+                variant_products.add(item.product_id)
+
+        touched = {item.product_id for item in items}
+        if variant_products:
+            _recompute_product_stock(variant_products, now)
+        sold_out = Product.objects.filter(pk__in=touched, stock=0).update(is_available=False)
+
+        order = Order.objects.create(
+            user=user,
+            payment_method=payment_method,
+            total_amount=sum(item.product.price * item.quantity for item in items),
+            **shipping,
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=item.product,
+                quantity=item.quantity,
+                price=item.product.price,
+                size=item.size,
+            )
+            for item in items
+        ])
+        cart.clear()
+
+        # Queryset updates skip the model signals; invalidate catalog caches once.
+        # The typeahead index only changes when a product sold out.
+        transaction.on_commit(lambda: bump_version('catalog'))
+        if sold_out:
+            transaction.on_commit(lambda: bump_version('suggest'))
+
+    return order
+
+
+def update_order_status(orders, status):
+    """
+    Move every order in the `orders` queryset to `status`.
+
+    Orders already in `status` are left alone. Queryset updates skip the
+    post_save signal, so the status notifications are queued here, in the
+    same transaction.
+
+    Returns:
+        int: number of orders changed
+    """
+    with transaction.atomic():
+        changes = [
+            StatusChange(order_id, user_id, old_status, status)
+            for order_id, user_id, old_status in (
+                orders.exclude(status=status).select_for_update()
+                .order_by('pk').values_list('pk', 'user_id', 'status')
+            )
+        ]
+        if not changes:
+            return 0
+        Order.objects.filter(pk__in=[change.order_id for change in changes]).update(
+            status=status, updated_at=timezone.now(),
+        )
+        enqueue_status_changes(changes)
+    return len(changes)
+
+
+def order_history(user):
+    """
+    `user`'s orders with their lines, products and product images prefetched
+    (four queries however many orders are on the page).
+    """
+    items = OrderItem.objects.select_related('product').prefetch_related(
+        Prefetch('product__images', queryset=ProductImage.objects.order_by('pk')),
+    ).order_by('pk')
+    return Order.objects.filter(user=user).prefetch_related(Prefetch('items', queryset=items))
+
+
+def serialize_order(order):
+    return {
+        'id': order.id,
+        'order_number': order.order_number,
+        'status': order.status,
+        'status_display': order.get_status_display(),
+        'payment_method': order.payment_method,
+        'payment_status': order.payment_status,
+        'total_amount': float(order.total_amount),
+        'created_at': order.created_at.isoformat(),
+        'items': [
+            {
+                'product_id': item.product_id,
+                'name': item.product.name,
+                'image_url': item.product.get_image_url,
+                'size': item.size,
+                'quantity': item.quantity,
+                'price': float(item.price),
+                'total': float(item.get_total()),
+            }
+            for item in order.items.all()
+        ],
+    }
@@ -0,0 +1,387 @@
+"""
+Transactional notification outbox
+Signal handlers call enqueue_* inside the transaction that changes the order, so
+a notification row exists if and only if the change committed. The worker
+(`manage.py run_notification_worker`) claims due rows, sends the emails over
+one batched SMTP connection and the other channels on a thread pool, and
+records the outcome; failures are retried with exponential backoff until
+MAX_ATTEMPTS.
+
+Claimed rows get a lease (next_attempt_at moves LEASE ahead), so rows held by
+a worker that died are picked up again once the lease runs out.
+
+Status changes are coalesced: the first change of an order is held for
+NOTIFICATION_COALESCE_WINDOW seconds, and later changes fold into that pending
+row (its payload keeps the trail of states) instead of queueing another
+message. With NOTIFICATION_STATUS_DIGEST on, changes are instead collected
+into one pending digest per customer, sent at NOTIFICATION_DIGEST_HOUR.
+
+A sender raises Postpone when its message can't go out yet (a restocked
+product that isn't on sale); the message is retried later without using up
+an attempt.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Order, OutboxMessage
+from .notifications import (
+    BatchMailer,
+    order_confirmation_email,
+    order_digest_email,
+    order_status_update_email,
+    send_order_confirmation,
+    send_order_digest,
+    send_order_status_update,
+)
+from .stock_alerts import fan_out_restock
+
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 30  # seconds; doubles after every failed attempt
+BACKOFF_MAX = 60 * 60
+LEASE = timedelta(minutes=5)
+# A restocked product that isn't on sale yet is checked again this often, for up to RESTOCK_MAX_WAIT
+RESTOCK_RECHECK = timedelta(hours=1)
+RESTOCK_MAX_WAIT = timedelta(days=7)
+
+Kinds = OutboxMessage.Kinds
+Statuses = OutboxMessage.Statuses
+
+StatusChange = namedtuple('StatusChange', ['order_id', 'user_id', 'old_status', 'new_status'])
+
+
+def _channels():
+    channels = [OutboxMessage.Channels.EMAIL]
+    if getattr(settings, 'WHATSAPP_ENABLED', False):
+        channels.append(OutboxMessage.Channels.WHATSAPP)
+    return channels
+
+
+def enqueue(kind, order=None, payload=None):
+    """Queue one message per enabled channel (call inside the writer's transaction)"""
+    OutboxMessage.objects.bulk_create([
+        OutboxMessage(kind=kind, channel=channel, order=order, payload=payload or {})
+        for channel in _channels()
+    ])
+
+
+def enqueue_order_confirmation(order):
+    enqueue(Kinds.ORDER_CONFIRMATION, order=order)
+
+
+def _next_digest_time(now):
+    hour = getattr(settings, 'NOTIFICATION_DIGEST_HOUR', 9)
+    due = timezone.localtime(now).replace(hour=hour, minute=0, second=0, microsecond=0)
+    if due <= now:
+        due += timedelta(days=1)
+    return due
+
+
+def _fold_status_changes(kind, key_field, changes, defaults, record_change):
+    """
+    Fold each change into the pending `kind` message for its key (order or
+    customer) on every channel, creating the messages that don't exist yet.
+    One locking SELECT, one bulk INSERT and one bulk UPDATE however many
+    changes there are.
+
+    Args:
+        changes: {key: [StatusChange, ...]}
+        record_change: function(payload, change) updating a message payload
+    """
+    with transaction.atomic():
+        pending = {
+            (getattr(message, key_field), message.channel): message
+            for message in OutboxMessage.objects.select_for_update().filter(
+                kind=kind, status=Statuses.PENDING, **{f'{key_field}__in': list(changes)},
+            )
+        }
+        created, updated = [], []
+        for key, key_changes in changes.items():
+            for channel in _channels():
+                message = pending.get((key, channel))
+                if message is None:
+                    message = OutboxMessage(kind=kind, channel=channel, payload={}, **{key_field: key}, **defaults)
+                    created.append(message)
+                else:
+                    updated.append(message)
+                for change in key_changes:
+                    record_change(message.payload, change)
+        OutboxMessage.objects.bulk_create(created, batch_size=500)
+        OutboxMessage.objects.bulk_update(updated, ['payload'], batch_size=500)
+
+
+def _add_to_trail(payload, change):
+    payload.setdefault('old_status', change.old_status)
+    payload.setdefault('trail', [change.old_status]).append(change.new_status)
+
+
+def _add_to_digest(payload, change):
+    trail = payload.setdefault('orders', {}).setdefault(str(change.order_id), [change.old_status])
+    trail.append(change.new_status)
+
+
+def enqueue_status_changes(changes):
+    """
+    Queue notifications for a batch of StatusChange tuples (call inside the
+    writer's transaction).
+    """
+    now = timezone.now()
+    grouped = {}
+    if getattr(settings, 'NOTIFICATION_STATUS_DIGEST', False):
+        for change in changes:
+            grouped.setdefault(change.user_id, []).append(change)
+        _fold_status_changes(
+            Kinds.ORDER_DIGEST, 'user_id', grouped,
+            {'next_attempt_at': _next_digest_time(now)}, _add_to_digest,
+        )
+    else:
+        for change in changes:
+            grouped.setdefault(change.order_id, []).append(change)
+        window = timedelta(seconds=getattr(settings, 'NOTIFICATION_COALESCE_WINDOW', 120))
+        _fold_status_changes(
+            Kinds.ORDER_STATUS_UPDATE, 'order_id', grouped,
+            {'next_attempt_at': now + window}, _add_to_trail,
+        )
+
+
+def enqueue_order_status_update(order, old_status):
+    enqueue_status_changes([StatusChange(order.pk, order.user_id, old_status, order.status)])
+
+
+def enqueue_restock(product_id, size=None):
+    """One fan-out job per restock; the worker notifies the subscribers (see stock_alerts.py)"""
+    OutboxMessage.objects.create(
+        kind=Kinds.BACK_IN_STOCK,
+        channel=OutboxMessage.Channels.FANOUT,
+        payload={'product_id': product_id, 'size': size},
+    )
+
+
+def _status_trail(message):
+    """
+    The statuses a coalesced update went through, ending at the order's
+    current status; None if the order is back where it started.
+    """
+    order = message.order
+    trail = list(message.payload.get('trail') or [message.payload.get('old_status')])
+    if trail[-1] != order.status:
+        trail.append(order.status)
+    if trail[0] == order.status:
+        return None
+    return trail
+
+
+def _status_update_email(message):
+    trail = _status_trail(message)
+    if trail is None:
+        return None
+    return order_status_update_email(message.order, trail[0], trail)
+
+
+def _send_status_update(message):
+    trail = _status_trail(message)
+    if trail is None:
+        return {}
+    return send_order_status_update(message.order, trail[0], channels=[message.channel], trail=trail)
+
+
+def _digest_updates(message):
+    """(order, trail) pairs for the orders in a digest that actually changed"""
+    trails = message.payload.get('orders', {})
+    orders = Order.objects.filter(user_id=message.user_id, pk__in=[int(pk) for pk in trails]).order_by('pk')
+    updates = []
+    for order in orders:
+        trail = list(trails[str(order.pk)])
+        if trail[-1] != order.status:
+            trail.append(order.status)
+        if trail[0] != order.status:
+            updates.append((order, trail))
+    return updates
+
+
+def _digest_email(message):
+    updates = _digest_updates(message)
+    return order_digest_email(message.user, updates) if updates else None
+
+
+def _send_digest(message):
+    updates = _digest_updates(message)
+    return send_order_digest(message.user, updates, channels=[message.channel]) if updates else {}
+
+
+# kind -> function(message) returning the email to send (None: nothing to send)
+EMAIL_BUILDERS = {
+    Kinds.ORDER_CONFIRMATION: lambda message: order_confirmation_email(message.order),
+    Kinds.ORDER_STATUS_UPDATE: _status_update_email,
+    Kinds.ORDER_DIGEST: _digest_email,
+}
+
+
+class Postpone(Exception):
+    """Raised by a sender when its message can't go out yet; it is retried after `delay`"""
+
+    def __init__(self, reason, delay):
+        super().__init__(reason)
+        self.delay = delay
+
+
+def _fan_out(message):
+    notified = fan_out_restock(message.payload['product_id'], message.payload.get('size'))
+    if notified is None:
+        if timezone.now() - message.created_at < RESTOCK_MAX_WAIT:
+            raise Postpone('product is not on sale yet', RESTOCK_RECHECK)
+        print(f"Dropping back-in-stock job for product {message.payload['product_id']}: never put on sale")
+    # The job has run; per-subscriber failures are re-armed by fan_out_restock
+    return {message.channel: True}
+
+
+# kind -> function(message) returning {channel: sent ok}; used for non-email channels
+SENDERS = {
+    Kinds.ORDER_CONFIRMATION: lambda message: send_order_confirmation(
+        message.order, channels=[message.channel],
+    ),
+    Kinds.ORDER_STATUS_UPDATE: _send_status_update,
+    Kinds.ORDER_DIGEST: _send_digest,
+    Kinds.BACK_IN_STOCK: _fan_out,
+}
+
+
+def _due(now):
+    """
+    Due messages, locked for claiming. Only the outbox rows are locked: order and
+    user are nullable, and PostgreSQL refuses FOR UPDATE on the nullable side of
+    the outer joins select_related() uses for them.
+    """
+    return (
+        OutboxMessage.objects.select_for_update(skip_locked=True, of=('self',))
+        .filter(status__in=[Statuses.PENDING, Statuses.SENDING], next_attempt_at__lte=now)
+        .select_related('order__user__profile', 'user__profile')
+        .order_by('next_attempt_at', 'pk')
+    )
+
+
+def claim(limit):
+    """
+    Lease up to `limit` due messages to this worker.
+
+    Returns:
+        list: OutboxMessage objects (order and user loaded)
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(_due(now)[:limit])
+        OutboxMessage.objects.filter(pk__in=[message.pk for message in messages]).update(
+            status=Statuses.SENDING, next_attempt_at=now + LEASE,
+        )
+    return messages
+
+
+def _backoff(attempts):
+    return timedelta(seconds=min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX))
+
+
+def record(message, delivered, error=''):
+    """Store the outcome of a delivery attempt"""
+    now = timezone.now()
+    attempts = message.attempts + 1
+    if delivered:
+        fields = {'status': Statuses.SENT, 'sent_at': now, 'last_error': ''}
+    elif attempts >= MAX_ATTEMPTS:
+        fields = {'status': Statuses.FAILED, 'last_error': error}
+    else:
+        fields = {'status': Statuses.PENDING, 'next_attempt_at': now + _backoff(attempts), 'last_error': error}
+    OutboxMessage.objects.filter(pk=message.pk).update(attempts=attempts, **fields)
+    return delivered
+
+
+def postpone(message, delay, reason=''):
+    """Put a message back in the queue for later without counting an attempt"""
+    OutboxMessage.objects.filter(pk=message.pk).update(
+        status=Statuses.PENDING, next_attempt_at=timezone.now() + delay, last_error=reason,
+    )
+
+
+def deliver(message):
+    """
+    Send one claimed message on its own and record the result.
+
+    Returns:
+        bool: True if it was delivered (or had no recipient on its channel)
+    """
+    error = ''
+    try:
+        results = SENDERS[message.kind](message)
+        # No entry means there was no recipient for this channel: nothing to retry
+        delivered = results.get(message.channel, True)
+        if not delivered:
+            error = f'{message.channel} send failed'
+    except Postpone as e:
+        postpone(message, e.delay, str(e))
+        return False
+    except Exception as e:
+        delivered = False
+        error = str(e)
+    return record(message, delivered, error)
+
+
+def deliver_emails(messages):
+    """
+    Send claimed email messages over one SMTP connection (see BatchMailer).
+
+    Returns:
+        int: number delivered
+    """
+    delivered = 0
+
+    def on_result(message, ok, error):
+        nonlocal delivered
+        delivered += record(message, ok, error)
+
+    with BatchMailer(on_result=on_result) as mailer:
+        for message in messages:
+            try:
+                email = EMAIL_BUILDERS[message.kind](message)
+            except Exception as e:
+                record(message, False, str(e))
+                continue
+            if email is None:
+                delivered += record(message, True)
+            else:
+                mailer.add(email, message)
+    return delivered
+
+
+def _in_thread(func, *args):
+    try:
+        return func(*args)
+    finally:
+        # Each pool thread opens its own connection; don't leak it
+        connection.close()
+
+
+def process_batch(limit=50, workers=4):
+    """
+    Claim and deliver one batch.
+
+    Returns:
+        tuple: (messages processed, messages delivered)
+    """
+    messages = claim(limit)
+    if not messages:
+        return 0, 0
+
+    emails = [message for message in messages if message.channel == OutboxMessage.Channels.EMAIL]
+    others = [message for message in messages if message.channel != OutboxMessage.Channels.EMAIL]
+    if workers <= 1 or not others:
+        delivered = deliver_emails(emails) + sum(deliver(message) for message in others)
+    else:
+        # Emails share one SMTP connection on one thread; other channels use the rest of the pool
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            email_future = pool.submit(_in_thread, deliver_emails, emails)
+            delivered = sum(pool.map(lambda message: _in_thread(deliver, message), others))
+            delivered += email_future.result()
+    return len(messages), delivered
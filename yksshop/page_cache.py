@@ -0,0 +1,68 @@
+"""
+Full-page cache for anonymous catalog traffic
+Anonymous visitors without a guest cart all see the same homepage/catalog/
+product pages, so the rendered response is cached per path + query string. Keys embed the shared
+'catalog' version, which signals bump on any catalog write, so stale pages are
+never served after an admin edit. Without a shared cache (LocMem) other workers
+miss the bump, so pages are then kept for at most local_max_age() seconds.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .guest_cart import has_guest_cart
+from .versioning import get_version, local_max_age
+
+
+def _cache_key(request):
+    digest = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f"yksshop:page:{get_version('catalog')}:{digest}"
+
+
+def _is_cacheable_request(request):
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        # The header shows the guest cart's item count
+        and not has_guest_cart(request)
+    )
+
+
+def _is_cacheable_response(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        # A page that rendered {% csrf_token %} is tied to this visitor's cookie
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+        and not response.has_header('Vary')
+    )
+
+
+def anonymous_page_cache(view_func):
+    """
+    Serve and store the rendered page for unauthenticated GET requests.
+    Timeout: settings.ANONYMOUS_PAGE_CACHE_TIMEOUT (seconds, default 300), capped
+    by local_max_age().
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not _is_cacheable_request(request):
+            return view_func(request, *args, **kwargs)
+
+        key = _cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = view_func(request, *args, **kwargs)
+        if _is_cacheable_response(request, response):
+            timeout = getattr(settings, 'ANONYMOUS_PAGE_CACHE_TIMEOUT', 300)
+            cache.set(key, (response.content, response['Content-Type']), local_max_age(timeout))
+        return response
+
+    return wrapper
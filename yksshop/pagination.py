@@ -0,0 +1,111 @@
+"""
+Keyset (cursor) pagination for catalog listings and order history
+Pages are ordered by a pair of keys, newest/best first, so deep pages cost the
+same as the first one. The default order is (created_at, id).
+"""
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+def get_page_size(request, default=None, maximum=100):
+    """Read ?page_size= from the request, clamped to a sane range"""
+    default = default or getattr(settings, 'CATALOG_PAGE_SIZE', 24)
+    try:
+        page_size = int(request.GET.get('page_size', default))
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(page_size, maximum))
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder truncates datetimes to milliseconds; a cursor needs the
+    full value or rows created in the same millisecond are skipped.
+    """
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    """Encode the key values of the last row on a page as an opaque URL-safe token"""
+    raw = json.dumps(list(values), cls=CursorEncoder, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size=2):
+    """
+    Decode a cursor produced by encode_cursor
+
+    Returns:
+        list: the key values, or None if the cursor is missing or malformed
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def page_urls(request, next_cursor):
+    """
+    Links for a cursor-paginated page, keeping the other query parameters
+
+    Returns:
+        tuple: (first page URL or None when already on it, next page URL or None)
+    """
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    first_page_url = None
+    if request.GET.get('cursor'):
+        first_page_url = f"{request.path}?{params.urlencode()}"
+    next_page_url = None
+    if next_cursor:
+        params['cursor'] = next_cursor
+        next_page_url = f"{request.path}?{params.urlencode()}"
+    return first_page_url, next_page_url
+
+
+def paginate_keyset(queryset, cursor=None, page_size=24, keys=('created_at', 'id')):
+    """
+    Return one page of `queryset` after `cursor`, ordered by `keys` descending
+
+    The last key must be unique (normally the primary key) so the order is total.
+
+    Returns:
+        tuple: (list of objects, next cursor or None when this is the last page)
+    """
+    primary, tiebreak = keys
+    queryset = queryset.order_by(f'-{primary}', f'-{tiebreak}')
+
+    position = decode_cursor(cursor)
+    if position:
+        primary_value, tiebreak_value = position
+        try:
+            queryset = queryset.filter(
+                Q(**{f'{primary}__lt': primary_value})
+                | Q(**{primary: primary_value, f'{tiebreak}__lt': tiebreak_value})
+            )
+        except (TypeError, ValueError, ValidationError):
+            pass
+
+    # Fetch one extra row to learn whether another page exists
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, key) for key in keys)
+    return items, next_cursor
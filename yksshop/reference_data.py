@@ -0,0 +1,61 @@
+"""
+Process-local cache for site reference data
+The homepage hero, the ordered category list and the category slug -> id map
+change only through the admin, so each worker keeps them in memory and reloads
+them when the shared 'reference' version (bumped by save/delete signals) moves,
+or after LOCAL_CACHE_MAX_AGE when the cache isn't shared between workers.
+"""
+import threading
+import time
+
+from .versioning import get_version, local_max_age
+
+
+class ReferenceData:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._loaded_at = 0
+        self._hero = None
+        self._categories = []
+        self._category_ids = {}
+
+    def _is_fresh(self, version):
+        if version != self._version:
+            return False
+        max_age = local_max_age()
+        return max_age is None or time.monotonic() - self._loaded_at < max_age
+
+    def _ensure_fresh(self):
+        version = get_version('reference')
+        if self._is_fresh(version):
+            return
+        with self._lock:
+            if self._is_fresh(version):
+                return
+            from .models import Category, HomeHero
+
+            categories = list(Category.objects.order_by('pk'))
+            self._hero = HomeHero.get_solo()
+            self._categories = categories
+            self._category_ids = {category.slug: category.pk for category in categories}
+            self._version = version
+            self._loaded_at = time.monotonic()
+
+    @property
+    def hero(self):
+        self._ensure_fresh()
+        return self._hero
+
+    @property
+    def categories(self):
+        self._ensure_fresh()
+        return self._categories
+
+    def category_id(self, slug):
+        """Primary key for a category slug, or None if no such category exists"""
+        self._ensure_fresh()
+        return self._category_ids.get(slug)
+
+
+reference_data = ReferenceData()
@@ -0,0 +1,186 @@
+"""
+Full-text product search
+Keeps a search document per product in a shadow table and queries it with the
+database's native full-text engine:
+- PostgreSQL: tsvector column with a GIN index (yksshop_product_search)
+- SQLite: FTS5 virtual table (yksshop_product_fts)
+Other databases fall back to icontains filtering.
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+PG_TABLE = 'yksshop_product_search'
+FTS_TABLE = 'yksshop_product_fts'
+
+# Fields that feed the search document; saves touching only other fields skip reindexing
+INDEXED_FIELDS = {'name', 'description', 'category', 'category_id'}
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+PG_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(%s, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(%s, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(%s, '')), 'C')"
+)
+
+
+def _tokens(query):
+    return _TOKEN_RE.findall(query.lower())[:10]
+
+
+class PostgresSearchBackend:
+    vendor = 'postgresql'
+
+    def to_query(self, query):
+        # Every term must match, each as a prefix for search-as-you-type
+        return ' & '.join(f'{token}:*' for token in _tokens(query))
+
+    def search(self, queryset, query):
+        tsquery = self.to_query(query)
+        if not tsquery:
+            return queryset.none()
+        return queryset.filter(
+            id__in=RawSQL(
+                f"SELECT product_id FROM {PG_TABLE} "
+                f"WHERE document @@ to_tsquery('english', %s)",
+                (tsquery,),
+            )
+        ).annotate(
+            # ts_rank() is float4; as float8 the rank survives the round trip through
+            # a page cursor (a Python float) and compares equal on the next page
+            search_rank=RawSQL(
+                f"SELECT ts_rank(document, to_tsquery('english', %s))::float8 "
+                f"FROM {PG_TABLE} WHERE product_id = yksshop_product.id",
+                (tsquery,),
+                output_field=FloatField(),
+            )
+        )
+
+    def index_product(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {PG_TABLE} (product_id, document) VALUES (%s, {PG_DOCUMENT}) "
+                f"ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                (product.pk, product.name, product.category.name, product.description),
+            )
+
+    def remove_product(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {PG_TABLE} WHERE product_id = %s", (product_id,))
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {PG_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {PG_TABLE} (product_id, document) "
+                f"SELECT p.id, {PG_DOCUMENT % ('p.name', 'c.name', 'p.description')} "
+                f"FROM yksshop_product p JOIN yksshop_category c ON c.id = p.category_id"
+            )
+            return cursor.rowcount
+
+
+class SQLiteSearchBackend:
+    vendor = 'sqlite'
+
+    def to_query(self, query):
+        # Quote every token so user input can never inject FTS5 syntax
+        return ' '.join(f'"{token}"*' for token in _tokens(query))
+
+    def search(self, queryset, query):
+        match = self.to_query(query)
+        if not match:
+            return queryset.none()
+        return queryset.filter(
+            id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match,))
+        ).annotate(
+            # bm25() is lower-is-better; negate it so rank sorts descending like Postgres
+            search_rank=RawSQL(
+                f"SELECT -bm25({FTS_TABLE}, 10.0, 5.0, 1.0) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s AND rowid = yksshop_product.id",
+                (match,),
+                output_field=FloatField(),
+            )
+        )
+
+    def index_product(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", (product.pk,))
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, category, description) VALUES (%s, %s, %s, %s)",
+                (product.pk, product.name, product.category.name, product.description),
+            )
+
+    def remove_product(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", (product_id,))
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, category, description) "
+                f"SELECT p.id, p.name, c.name, p.description "
+                f"FROM yksshop_product p JOIN yksshop_category c ON c.id = p.category_id"
+            )
+            indexed = cursor.rowcount
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+            return indexed
+
+
+class FallbackSearchBackend:
+    vendor = None
+
+    def search(self, queryset, query):
+        return queryset.filter(
+            Q(name__icontains=query) | Q(description__icontains=query)
+        ).annotate(search_rank=RawSQL('0', (), output_field=FloatField()))
+
+    def index_product(self, product):
+        pass
+
+    def remove_product(self, product_id):
+        pass
+
+    def rebuild(self):
+        return 0
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend(),
+    'sqlite': SQLiteSearchBackend(),
+}
+
+
+def get_backend():
+    return BACKENDS.get(connection.vendor, FallbackSearchBackend())
+
+
+def search_products(queryset, query):
+    """
+    Filter `queryset` to products matching `query`, annotated with `search_rank`
+    (higher is a better match)
+    """
+    return get_backend().search(queryset, query)
+
+
+def index_product(product):
+    get_backend().index_product(product)
+
+
+def remove_product(product_id):
+    get_backend().remove_product(product_id)
+
+
+def index_category(category):
+    """Reindex every product in `category` (its name is part of the document)"""
+    backend = get_backend()
+    for product in category.products.select_related('category').iterator():
+        backend.index_product(product)
+
+
+def rebuild_index():
+    """Rebuild the whole search index in bulk. Returns the number of products indexed."""
+    return get_backend().rebuild()
@@ -1,65 +1,141 @@
 """
 Django signals for automatic notifications
-Handles automatic email & WhatsApp notifications for orders and stock updates.
+Queues email & WhatsApp notifications for orders (see outbox.py) and handles stock updates.
 """
 
-from django.db.models.signals import post_save, pre_save
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from .models import Order, Product
-from .notifications import (  # ✅ note: use singular 'notification' (not notifications)
-    send_order_confirmation,
-    send_order_status_update,
-    send_product_back_in_stock,
-)
+from . import search
+from .jwt_auth import invalidate_user
+from .models import Cart, Category, HomeHero, Order, Product, ProductImage, ProductVariant
+from .versioning import bump_version
+from .outbox import enqueue_order_confirmation, enqueue_order_status_update, enqueue_restock
+from .stock_alerts import pending_subscribers
 
-_old_order_status = {}
+
+@receiver(post_save, sender=Order)
+def order_post_save_handler(sender, instance, created, **kwargs):
+    """
+    Queue notifications when an order is created or its status changes.
+    - On creation: order confirmation
+    - On status update: status update notification
+    The rows join the saving transaction; run_notification_worker delivers them.
+    Errors propagate on purpose: the save must not commit without its rows
+    (savers wrap the change in transaction.atomic()).
+    """
+    if created:
+        # 📨 Queue order confirmation (email + WhatsApp)
+        enqueue_order_confirmation(instance)
+    else:
+        # Detect status change (Order tracks 'status'; see FieldTrackerMixin)
+        old_status = instance.previous('status')
+        if old_status and instance.has_changed('status'):
+            enqueue_order_status_update(instance, old_status)
 
 
-@receiver(pre_save, sender=Order)
-def order_pre_save_handler(sender, instance, **kwargs):
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+def restock_handler(sender, instance, created, **kwargs):
     """
-    Store old order status before saving, so we can detect status changes.
+    Queue one back-in-stock fan-out when a product or size goes from 0 to positive stock.
+    Compares against the stock the instance was loaded with (FieldTrackerMixin),
+    so ordinary saves cost no extra query.
     """
-    if instance.pk:
-        try:
-            old_order = Order.objects.get(pk=instance.pk)
-            _old_order_status[instance.pk] = old_order.status
-        except Order.DoesNotExist:
-            pass
+    if created or instance.previous('stock') != 0 or instance.stock <= 0:
+        return
 
+    if sender is ProductVariant:
+        product_id, size = instance.product_id, instance.size
+    elif not instance.has_size_variants:
+        # Sized products restock per variant; their total follows the variants.
+        # Still unavailable is fine: the job waits until the product is on sale.
+        product_id, size = instance.pk, None
+    else:
+        return
+    if pending_subscribers(product_id, size).exists():
+        # ✅ Back in stock — the notification worker notifies the subscribers
+        enqueue_restock(product_id, size)
 
-@receiver(post_save, sender=Order)
-def order_post_save_handler(sender, instance, created, **kwargs):
+
+@receiver(post_save, sender=Product)
+def product_search_index_handler(sender, instance, update_fields=None, **kwargs):
     """
-    Send notifications when an order is created or its status changes.
-    - On creation: send order confirmation
-    - On status update: send status update notification
+    Keep the full-text search document in sync with the product.
+    Saves that only touch stock/availability don't change the document.
     """
-    try:
-        if created:
-            # 📨 Send order confirmation (email + WhatsApp)
-            send_order_confirmation(instance)
-        else:
-            # Detect status change
-            old_status = _old_order_status.pop(instance.pk, None)
-            if old_status and instance.status != old_status:
-                send_order_status_update(instance, old_status)
-    except Exception as e:
-        print(f"[Signal Error] order_post_save_handler: {e}")
-        import traceback
-        print(traceback.format_exc())
-
-
-@receiver(pre_save, sender=Product)
-def product_stock_handler(sender, instance, **kwargs):
+    if update_fields and not search.INDEXED_FIELDS.intersection(update_fields):
+        return
+    search.index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def product_search_remove_handler(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def category_search_index_handler(sender, instance, created, **kwargs):
+    if not created:
+        search.index_category(instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=HomeHero)
+@receiver(post_delete, sender=HomeHero)
+def catalog_version_handler(sender, **kwargs):
     """
-    Detect when a product that was out of stock comes back in stock.
+    Bump the shared catalog version so caches keyed on it (facet counts,
+    anonymous page cache) are invalidated on their next read.
     """
-    if instance.pk:
-        try:
-            old_product = Product.objects.get(pk=instance.pk)
-            if old_product.stock == 0 and instance.stock > 0 and instance.is_available:
-                # ✅ Product is back in stock — trigger notification
-                send_product_back_in_stock(instance)
-        except Product.DoesNotExist:
-            pass
+    bump_version('catalog')
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def suggest_version_handler(sender, **kwargs):
+    """Product/category edits can change names, slugs or prices in the typeahead index"""
+    bump_version('suggest')
+
+
+@receiver(post_save, sender=ProductVariant)
+def variant_suggest_version_handler(sender, instance, created, **kwargs):
+    """A size restock or sell-out only matters to the index when it crosses zero"""
+    previous = instance.previous('stock')
+    if created or previous is None or (previous > 0) != (instance.stock > 0):
+        bump_version('suggest')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=HomeHero)
+@receiver(post_delete, sender=HomeHero)
+def reference_version_handler(sender, **kwargs):
+    """Bump the reference data version so every worker reloads hero/categories"""
+    bump_version('reference')
+
+
+@receiver(post_save, sender=Product)
+def cart_price_handler(sender, instance, created, update_fields=None, **kwargs):
+    """Carts store their total; re-derive it for carts holding a product whose price changed"""
+    if created or not instance.has_changed('price'):
+        return
+    Cart.objects.filter(items__product=instance).reconcile()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def jwt_user_cache_handler(sender, instance, created=False, **kwargs):
+    """Drop cached JWT users when they are saved (e.g. deactivated) or deleted"""
+    if not created:
+        invalidate_user(instance.pk)
@@ -0,0 +1,142 @@
+"""
+Back-in-stock alerts
+Shoppers subscribe to a product (optionally one size). When stock goes from 0
+to positive, signals.py queues a single fan-out job in the outbox; the
+notification worker runs it here: subscribers are streamed in chunks, the email
+and WhatsApp text are rendered once per restock, emails go out over one batched
+SMTP connection and WhatsApp messages over the pooled client. Subscribers whose
+email or WhatsApp message failed are re-armed for the next restock.
+"""
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from .models import Product, StockSubscription
+from .notifications import BatchMailer, get_site_url
+from .whatsapp import get_whatsapp_client
+
+CHUNK_SIZE = 500
+
+
+def subscribe(product, size=None, user=None, email='', phone=''):
+    """
+    Register interest in `product` (and `size`); repeated requests are no-ops.
+
+    Returns:
+        StockSubscription
+    """
+    lookup = {'product': product, 'size': size or None, 'notified_at__isnull': True}
+    if user is not None:
+        lookup['user'] = user
+    else:
+        lookup['email'] = email
+    subscription, _ = StockSubscription.objects.get_or_create(
+        **lookup, defaults={'email': email, 'phone': phone},
+    )
+    return subscription
+
+
+def pending_subscribers(product, size=None):
+    """Subscribers still waiting on `product`; a restocked size also wakes 'any size' subscribers"""
+    subscriptions = StockSubscription.objects.filter(product=product, notified_at__isnull=True)
+    if size:
+        subscriptions = subscriptions.filter(Q(size=size) | Q(size__isnull=True))
+    return subscriptions
+
+
+def _render(product, size):
+    context = {'product': product, 'size': size, 'site_url': get_site_url()}
+    html_content = render_to_string('shop/emails/product_back_in_stock.html', context)
+    subject = f"{product.name} is Back in Stock! | YKS Men's Wear"
+    size_line = f"Size: {size}\n" if size else ""
+    whatsapp_message = (
+        f"🎉 *Great News!*\n\n"
+        f"{product.name} is back in stock!\n"
+        f"{size_line}"
+        f"Price: Rs.{product.price}\n\n"
+        f"Shop now: {get_site_url()}/product/{product.slug}/"
+    )
+    return subject, html_content, strip_tags(html_content), whatsapp_message
+
+
+def fan_out_restock(product_id, size=None):
+    """
+    Notify everyone waiting on a restocked product/size.
+
+    Returns:
+        int: subscribers notified, or None if the stock is back but the product
+        isn't on sale yet (the caller should try again later)
+    """
+    product = Product.objects.filter(pk=product_id).prefetch_related('variants').first()
+    if product is None or product.get_stock_for_size(size) <= 0:
+        # Deleted, or sold out again before the job ran; keep the subscriptions
+        return 0
+    if not product.is_available:
+        return None
+
+    subject, html_content, text_content, whatsapp_message = _render(product, size)
+    whatsapp = get_whatsapp_client()
+    notified = 0
+    failed = []
+
+    def on_result(subscription_id, ok, error):
+        if not ok:
+            failed.append(subscription_id)
+
+    with BatchMailer(on_result=on_result) as mailer:
+        last_pk = 0
+        while True:
+            chunk = list(
+                pending_subscribers(product, size)
+                .filter(pk__gt=last_pk)
+                .select_related('user')
+                .order_by('pk')[:CHUNK_SIZE]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+
+            # Claim the chunk first so an overlapping job can't notify them twice,
+            # then send only to the rows stamped with this job's claim time
+            claim_time = timezone.now()
+            claimed = StockSubscription.objects.filter(
+                pk__in=[subscription.pk for subscription in chunk], notified_at__isnull=True,
+            ).update(notified_at=claim_time)
+            if not claimed:
+                continue
+            if claimed < len(chunk):
+                # Another job got to some of them between our select and update
+                ours = set(
+                    StockSubscription.objects.filter(
+                        pk__in=[subscription.pk for subscription in chunk], notified_at=claim_time,
+                    ).values_list('pk', flat=True)
+                )
+                chunk = [subscription for subscription in chunk if subscription.pk in ours]
+            notified += claimed
+
+            texted = []
+            for subscription in chunk:
+                email = subscription.email or (subscription.user.email if subscription.user else '')
+                if email:
+                    msg = EmailMultiAlternatives(
+                        subject=subject,
+                        body=text_content,
+                        from_email=settings.DEFAULT_FROM_EMAIL,
+                        to=[email],
+                    )
+                    msg.attach_alternative(html_content, 'text/html')
+                    mailer.add(msg, subscription.pk)
+                if subscription.phone and whatsapp is not None:
+                    texted.append(subscription)
+            if texted:
+                results = whatsapp.send_many([(subscription.phone, whatsapp_message) for subscription in texted])
+                failed.extend(subscription.pk for subscription, ok in zip(texted, results) if not ok)
+
+    if failed:
+        # Let the next restock try these addresses again
+        StockSubscription.objects.filter(pk__in=failed).update(notified_at=None)
+        print(f"Back-in-stock alert failed for {len(set(failed))} subscriber(s) of {product.name}")
+    return notified
@@ -0,0 +1,150 @@
+"""
+In-memory typeahead index for products and categories
+Names are kept in a sorted array of normalized keys per process, so a prefix
+lookup is a binary search plus a short scan and never touches the database.
+The index loads lazily and is rebuilt when the shared 'suggest' version moves.
+That version is bumped only for changes the index shows (names, categories,
+products going in or out of stock), not for every checkout; best-seller
+ranking is refreshed by rebuilding at most MAX_AGE seconds apart (sooner when
+the cache isn't shared between workers, see versioning.local_max_age).
+"""
+import bisect
+import re
+import threading
+import time
+
+from django.db.models import Count, Sum
+from django.urls import reverse
+
+from .versioning import get_version, local_max_age
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Upper bound on keys scanned per lookup so one-letter queries stay cheap
+MAX_SCAN = 2000
+# Seconds before units-sold ranking is reloaded even if nothing else changed
+MAX_AGE = 60 * 60
+
+
+def normalize(text):
+    return ' '.join(_WORD_RE.findall(text.lower()))
+
+
+def _keys(name):
+    """Every word-suffix of a name, so 'lin' and 'shi' both match 'Linen Shirt'"""
+    words = normalize(name).split()
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+class PrefixIndex:
+    def __init__(self, entries):
+        """
+        entries: list of dicts; each needs 'name' and a sortable 'score'
+        (higher ranks first)
+        """
+        self.entries = entries
+        pairs = sorted(
+            (key, position)
+            for position, entry in enumerate(entries)
+            for key in _keys(entry['name'])
+        )
+        self.keys = [key for key, _ in pairs]
+        self.positions = [position for _, position in pairs]
+
+    def lookup(self, query, limit=10):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+
+        start = bisect.bisect_left(self.keys, prefix)
+        matched = set()
+        for i in range(start, min(start + MAX_SCAN, len(self.keys))):
+            if not self.keys[i].startswith(prefix):
+                break
+            matched.add(self.positions[i])
+
+        ranked = sorted(sorted(matched), key=lambda position: self.entries[position]['score'], reverse=True)
+        return [self.entries[position] for position in ranked[:limit]]
+
+
+def _load_product_entries():
+    from .models import Product
+
+    products = (
+        Product.objects.for_listing()
+        .filter(is_available=True)
+        .annotate(units_sold=Sum('orderitem__quantity'))
+        .only('id', 'name', 'slug', 'price', 'stock', 'image')
+    )
+    entries = []
+    for product in products:
+        in_stock = product.total_stock > 0
+        entries.append({
+            'name': product.name,
+            # In-stock products first, then best sellers
+            'score': (in_stock, product.units_sold or 0),
+            'data': {
+                'id': product.id,
+                'name': product.name,
+                'slug': product.slug,
+                'price': float(product.price),
+                'in_stock': in_stock,
+                'url': reverse('product_detail', args=[product.slug]),
+            },
+        })
+    return entries
+
+
+def _load_category_entries():
+    from .models import Category
+
+    categories = Category.objects.annotate(product_count=Count('products')).only('id', 'name', 'slug')
+    return [
+        {
+            'name': category.name,
+            'score': (category.product_count > 0, category.product_count),
+            'data': {
+                'id': category.id,
+                'name': category.name,
+                'slug': category.slug,
+                'url': f"{reverse('product_list')}?category={category.slug}",
+            },
+        }
+        for category in categories
+    ]
+
+
+class SuggestIndex:
+    """Per-process products/categories index, rebuilt when the suggest version changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._built_at = 0
+        self._products = None
+        self._categories = None
+
+    def _is_fresh(self, version):
+        return version == self._version and time.monotonic() - self._built_at < local_max_age(MAX_AGE)
+
+    def _ensure_fresh(self):
+        version = get_version('suggest')
+        if self._is_fresh(version):
+            return
+        with self._lock:
+            if self._is_fresh(version):
+                return
+            self._products = PrefixIndex(_load_product_entries())
+            self._categories = PrefixIndex(_load_category_entries())
+            self._version = version
+            self._built_at = time.monotonic()
+
+    def suggest(self, query, limit=8):
+        self._ensure_fresh()
+        return {
+            'products': [entry['data'] for entry in self._products.lookup(query, limit)],
+            'categories': [entry['data'] for entry in self._categories.lookup(query, limit)],
+        }
+
+
+suggest_index = SuggestIndex()
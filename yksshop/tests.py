@@ -1,3 +1,875 @@
-from django.test import TestCase
+import json
+import smtplib
+import threading
+import time
+import zlib
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs
 
-# Create your tests here.
+import requests
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import DatabaseError, connection
+from django.db.models.signals import post_save
+from django.http import JsonResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import idempotency, jwt_auth, outbox, stock_alerts, whatsapp
+from .cart_view import cart_items_for_display
+from .models import (
+    Cart, CartItem, Category, HomeHero, Order, OutboxMessage, Product, ProductImage, ProductVariant,
+    StockSubscription,
+)
+from .notifications import BatchMailer
+from .order_numbers import OrderNumberAllocator
+from .orders import OrderError, place_order_from_cart
+from .pagination import paginate_keyset
+from .reference_data import ReferenceData
+from .search import search_products
+from .versioning import bump_version
+
+
+def make_order(user, **fields):
+    fields.setdefault('payment_method', 'cod')
+    fields.setdefault('total_amount', 500)
+    return Order.objects.create(
+        user=user, shipping_name='Ravi', shipping_phone='9876543210', shipping_address='1 MG Road',
+        shipping_city='Bengaluru', shipping_state='KA', shipping_pincode='560001', **fields,
+    )
+
+
+class StubTwilio:
+    """
+    Local stand-in for the Twilio Messages API: records each POSTed form and
+    answers with the next queued status code (201 once the queue is empty).
+    """
+
+    def __init__(self, statuses=()):
+        self.requests = []
+        self.statuses = list(statuses)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+                stub.requests.append(parse_qs(body))
+                self.send_response(stub.statuses.pop(0) if stub.statuses else 201)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_category(name='Shirts', slug='shirts'):
+    return Category.objects.create(name=name, slug=slug)
+
+
+def make_product(category, name, **fields):
+    fields.setdefault('price', 100)
+    fields.setdefault('stock', 5)
+    return Product.objects.create(
+        name=name, slug=name.lower().replace(' ', '-'), description='x', category=category, **fields,
+    )
+
+
+class KeysetPaginationTests(TestCase):
+    def test_rows_in_the_same_millisecond_are_not_skipped(self):
+        category = make_category()
+        base = timezone.now().replace(microsecond=123000)
+        products = []
+        for i in range(6):
+            product = make_product(category, f'P{i}')
+            # Six rows inside one millisecond, in pairs sharing a timestamp
+            Product.objects.filter(pk=product.pk).update(created_at=base + timedelta(microseconds=i // 2 * 100))
+            products.append(product)
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = paginate_keyset(Product.objects.all(), cursor, page_size=2)
+            seen.extend(product.name for product in page)
+            if cursor is None:
+                break
+        self.assertEqual(seen, [f'P{i}' for i in reversed(range(6))])
+
+
+    def test_search_ranks_tied_across_pages(self):
+        category = make_category()
+        for i in range(5):
+            make_product(category, f'Linen Shirt {i}')
+        results = search_products(Product.objects.all(), 'linen')
+        self.assertEqual(len({product.search_rank for product in results}), 1)
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = paginate_keyset(results, cursor, page_size=2, keys=('search_rank', 'id'))
+            seen.extend(product.pk for product in page)
+            if cursor is None:
+                break
+        self.assertEqual(seen, sorted(Product.objects.values_list('pk', flat=True), reverse=True))
+
+
+class ReferenceDataTests(TestCase):
+    def test_process_local_cache_reloads_after_max_age(self):
+        HomeHero.get_solo()
+        data = ReferenceData()
+        self.assertIsNone(data.category_id('shirts'))
+        # Created by "another worker": no version bump reaches this process
+        Category.objects.bulk_create([Category(name='Shirts', slug='shirts')])
+        self.assertIsNone(data.category_id('shirts'))
+
+        with mock.patch('yksshop.reference_data.time.monotonic', return_value=data._loaded_at + 61):
+            self.assertIsNotNone(data.category_id('shirts'))
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.category = make_category()
+        self.product = make_product(self.category, 'Linen Shirt')
+        make_product(self.category, 'Oxford Shirt')
+
+    def test_catalog_etag_changes_when_a_product_is_deleted(self):
+        response = self.client.get('/api/products/')
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.product.delete()
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_product_etag_changes_when_its_category_is_renamed(self):
+        url = f'/product/{self.product.slug}/'
+        etag = self.client.get(url)['ETag']
+        self.category.name = 'Summer Shirts'
+        self.category.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_unshared_validators_expire_after_local_max_age(self):
+        HomeHero.get_solo()
+        product_url = f'/product/{self.product.slug}/'
+        product_etag = self.client.get(product_url)['ETag']
+        catalog_etag = self.client.get('/api/products/')['ETag']
+        # Changed by "another worker": no version bump reaches this process
+        Product.objects.filter(pk=self.product.pk).update(name='Linen Kurta', updated_at=timezone.now())
+        self.assertEqual(self.client.get(product_url, HTTP_IF_NONE_MATCH=product_etag).status_code, 304)
+
+        with mock.patch('yksshop.conditional.time.time', return_value=time.time() + 61):
+            self.assertEqual(self.client.get(product_url, HTTP_IF_NONE_MATCH=product_etag).status_code, 200)
+            self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=catalog_etag).status_code, 200)
+
+
+class CartLineTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'pw')
+        self.client.force_login(self.user)
+        self.product = make_product(make_category(), 'Linen Shirt', price=250, stock=5)
+
+    def assertTotalsMatchLines(self, quantity):
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(sum(item.quantity for item in cart.items.all()), quantity)
+        self.assertEqual(cart.item_count, quantity)
+        self.assertEqual(cart.total, 250 * quantity)
+
+    def test_add_update_remove_keep_totals_in_step_with_lines(self):
+        for _ in range(2):
+            self.client.post('/api/add-to-cart/', {'product_id': self.product.pk, 'quantity': 1})
+        self.assertTotalsMatchLines(2)
+
+        item = Cart.objects.get(user=self.user).items.get()
+        self.client.post('/api/update-cart/', {'cart_item_id': item.pk, 'quantity': 4})
+        self.assertTotalsMatchLines(4)
+
+        self.client.post('/api/remove-from-cart/', {'cart_item_id': item.pk})
+        self.assertTotalsMatchLines(0)
+
+
+class GuestCartBadgeTests(TestCase):
+    def test_header_badge_counts_the_guest_cart(self):
+        product = make_product(make_category(), 'Linen Shirt', stock=5)
+        self.assertNotContains(self.client.get('/home/'), '<span class="cart-badge">')
+
+        self.client.post('/api/add-to-cart/', {'product_id': product.pk, 'quantity': 2})
+        self.assertContains(self.client.get('/home/'), '<span class="cart-badge">2</span>')
+
+        # The guest's page must not be served from the shared anonymous cache
+        self.client.cookies.clear()
+        self.assertNotContains(self.client.get('/home/'), '<span class="cart-badge">')
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'pw')
+        self.client.force_login(self.user)
+        category = make_category()
+        self.linen = make_product(category, 'Linen Shirt', stock=5)
+        self.oxford = make_product(category, 'Oxford Shirt', stock=5)
+        self.cart = Cart.objects.create(user=self.user)
+        self.linen_line = CartItem.objects.create(cart=self.cart, product=self.linen, quantity=3)
+        self.oxford_line = CartItem.objects.create(cart=self.cart, product=self.oxford, quantity=1)
+
+    def batch(self, *operations):
+        return self.client.post(
+            '/api/cart/batch/', json.dumps({'operations': list(operations)}), content_type='application/json',
+        ).json()
+
+    def test_line_over_stock_does_not_block_other_lines(self):
+        Product.objects.filter(pk=self.linen.pk).update(stock=1)
+        data = self.batch({'op': 'remove', 'cart_item_id': self.oxford_line.pk})
+        self.assertTrue(data['success'], data.get('message'))
+        self.assertEqual([line['id'] for line in data['items']], [self.linen_line.pk])
+
+        # Growing the over-stock line is still refused
+        data = self.batch({'op': 'update', 'cart_item_id': self.linen_line.pk, 'quantity': 4})
+        self.assertFalse(data['success'])
+
+    def test_cart_page_sends_changes_to_the_batch_endpoint(self):
+        response = self.client.get('/cart/')
+        self.assertContains(response, '/api/cart/batch/')
+        self.assertNotContains(response, '/api/update-cart/')
+
+
+SHIPPING = {
+    'shipping_name': 'Ravi', 'shipping_phone': '9876543210', 'shipping_address': '1 MG Road',
+    'shipping_city': 'Bengaluru', 'shipping_state': 'KA', 'shipping_pincode': '560001',
+}
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'pw')
+        self.client.force_login(self.user)
+        product = make_product(make_category(), 'Linen Shirt', stock=5)
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=product, quantity=1)
+
+    def place_order(self, key, **fields):
+        return self.client.post('/api/place-order/', {**SHIPPING, 'payment_method': 'cod', **fields},
+                                HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response_without_a_second_order(self):
+        first = self.place_order('order-1')
+        retry = self.place_order('order-1')
+        self.assertTrue(first.json()['success'])
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_same_key_with_a_different_body_is_rejected(self):
+        self.place_order('order-1')
+        response = self.place_order('order-1', shipping_city='Mysuru')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def request(self):
+        request = RequestFactory().post('/x/', {'a': '1'}, HTTP_IDEMPOTENCY_KEY='key-1')
+        request.user = self.user
+        return request
+
+    def run_view(self, view):
+        return idempotency.idempotent(view)(self.request())
+
+    def test_server_errors_are_not_stored(self):
+        statuses = iter([500, 200])
+        calls = []
+
+        def view(request):
+            calls.append(request)
+            return JsonResponse({'success': True}, status=next(statuses))
+
+        self.assertEqual(self.run_view(view).status_code, 500)
+        self.assertEqual(self.run_view(view).status_code, 200)
+        self.assertEqual(self.run_view(view).status_code, 200)
+        self.assertEqual(len(calls), 2)
+
+    def test_payment_confirmation_is_retried_after_a_transient_error(self):
+        order = make_order(self.user, payment_method='razorpay', razorpay_order_id='order_1')
+        data = {'razorpay_order_id': 'order_1', 'order_id': order.pk}
+        with mock.patch('yksshop.views.Order.save', side_effect=DatabaseError('db hiccup')):
+            response = self.client.post('/payment/failure/', data, HTTP_IDEMPOTENCY_KEY='failure-1')
+        self.assertEqual(response.status_code, 500)
+
+        self.client.post('/payment/failure/', data, HTTP_IDEMPOTENCY_KEY='failure-1')
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'cancelled')
+
+    def test_duplicate_in_flight_waits_for_the_first_response(self):
+        response_key, lock_key = idempotency._cache_keys(self.request(), 'view', 'key-1')
+        cache.add(lock_key, 1)
+        clock = mock.Mock(monotonic=time.monotonic)
+
+        def view(request):
+            self.fail('the duplicate must not run the view')
+
+        # Still running when the wait times out
+        with mock.patch.object(idempotency, 'time', clock), mock.patch.object(idempotency, 'WAIT_TIMEOUT', 0):
+            self.assertEqual(self.run_view(view).status_code, 409)
+
+        # The first request finishes while the duplicate waits
+        fingerprint = idempotency._request_fingerprint(self.request())
+        clock.sleep.side_effect = lambda seconds: cache.set(
+            response_key, (fingerprint, 201, 'application/json', zlib.compress(b'{"success": true}')),
+        )
+        with mock.patch.object(idempotency, 'time', clock):
+            response = self.run_view(view)
+        self.assertEqual((response.status_code, response['Idempotent-Replayed']), (201, 'true'))
+
+
+class CheckoutStockTests(TestCase):
+    def setUp(self):
+        category = make_category()
+        self.linen = make_product(category, 'Linen Shirt', stock=1)
+        self.oxford = make_product(category, 'Oxford Shirt', stock=5)
+
+    def shopper(self, name, *lines):
+        user = User.objects.create_user(name, f'{name}@example.com', 'pw')
+        cart = Cart.objects.create(user=user)
+        for product, quantity, *size in lines:
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity, size=size[0] if size else None)
+        return user
+
+    def test_last_unit_goes_to_exactly_one_of_two_orders(self):
+        first = self.shopper('asha', (self.linen, 1))
+        second = self.shopper('ravi', (self.linen, 1))
+        # The second checkout read its cart (stock 1) before the first one took the unit
+        stale_lines = list(cart_items_for_display(second.cart))
+        place_order_from_cart(first, 'cod', SHIPPING)
+        with mock.patch('yksshop.orders.cart_items_for_display', return_value=stale_lines):
+            with self.assertRaises(OrderError):
+                place_order_from_cart(second, 'cod', SHIPPING)
+
+        self.linen.refresh_from_db()
+        self.assertEqual(self.linen.stock, 0)
+        self.assertEqual(list(Order.objects.values_list('user__username', flat=True)), ['asha'])
+        self.assertEqual(second.cart.items.count(), 1)
+
+    def test_short_line_rolls_back_the_whole_order(self):
+        # Lines are taken in product order: the linen unit is taken before oxford comes up short
+        user = self.shopper('asha', (self.linen, 1), (self.oxford, 6))
+        with self.assertRaises(OrderError):
+            place_order_from_cart(user, 'cod', SHIPPING)
+
+        self.linen.refresh_from_db()
+        self.assertEqual((self.linen.stock, self.linen.is_available), (1, True))
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(user.cart.items.count(), 2)
+
+    def test_sold_out_products_are_marked_unavailable(self):
+        polo = make_product(make_category('Polos', 'polos'), 'Polo', stock=1)
+        ProductVariant.objects.bulk_create([
+            ProductVariant(product=polo, size='S', stock=1), ProductVariant(product=polo, size='M', stock=0),
+        ])
+        user = self.shopper('asha', (self.linen, 1), (self.oxford, 2), (polo, 1, 'S'))
+        place_order_from_cart(user, 'cod', SHIPPING)
+
+        available = dict(Product.objects.values_list('name', 'is_available'))
+        self.assertEqual(available, {'Linen Shirt': False, 'Oxford Shirt': True, 'Polo': False})
+        self.assertEqual(Product.objects.get(pk=self.oxford.pk).stock, 3)
+
+
+class FieldTrackerTests(TestCase):
+    def setUp(self):
+        self.product = make_product(make_category(), 'Linen Shirt', price=100, stock=5)
+
+    def test_loaded_values_are_the_baseline_for_changes(self):
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.previous('stock'), product.changed_fields()), (5, set()))
+
+        product.stock = 7
+        product.price = Decimal('100.00')
+        self.assertTrue(product.has_changed('stock'))
+        self.assertFalse(product.has_changed('price'))
+        self.assertEqual(product.changed_fields(), {'stock'})
+        self.assertEqual(product.previous('stock'), 5)
+
+    def test_post_save_sees_the_change_then_the_snapshot_moves_on(self):
+        seen = []
+
+        def handler(sender, instance, **kwargs):
+            seen.append((instance.previous('stock'), instance.changed_fields()))
+
+        post_save.connect(handler, sender=Product)
+        self.addCleanup(post_save.disconnect, handler, sender=Product)
+        product = Product.objects.get(pk=self.product.pk)
+        product.stock = 7
+        product.save()
+
+        self.assertEqual(seen, [(5, {'stock'})])
+        self.assertEqual((product.previous('stock'), product.changed_fields()), (7, set()))
+
+    def test_deferred_fields_are_not_reported_as_changed(self):
+        product = Product.objects.only('name').get(pk=self.product.pk)
+        self.assertEqual(product.changed_fields(), set())
+        self.assertIsNone(product.previous('stock'))
+
+        # Reading a deferred field loads its saved value
+        self.assertEqual(product.stock, 5)
+        self.assertEqual(product.previous('stock'), 5)
+        self.assertFalse(product.has_changed('stock'))
+
+        # Set without ever being loaded: the saved value is unknown, so it counts as changed
+        product.price = 250
+        self.assertEqual(product.changed_fields(), {'price'})
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        jwt_auth.user_cache.clear()
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'pw')
+
+    def get_user_info(self):
+        token = AccessToken.for_user(self.user)
+        return self.client.get('/api/user/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_warm_request_skips_the_user_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_user_info().status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_user_info().status_code, 200)
+
+    def test_deactivated_user_is_refused_while_cached(self):
+        self.get_user_info()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_user_info().status_code, 401)
+
+    def test_deactivation_in_another_process_is_seen_through_the_version(self):
+        self.get_user_info()
+        # Saved elsewhere: this process's entry stays, only the shared version moves
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        bump_version(f'user:{self.user.pk}')
+        self.assertIn(str(self.user.pk), jwt_auth.user_cache._entries)
+        self.assertEqual(self.get_user_info().status_code, 401)
+
+    def test_password_change_revokes_cached_tokens(self):
+        # Off by default; simplejwt's modules share this settings object
+        with mock.patch.object(jwt_auth.api_settings, 'CHECK_REVOKE_TOKEN', True):
+            token = AccessToken.for_user(self.user)
+            headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+            self.assertEqual(self.client.get('/api/user/', **headers).status_code, 200)
+            self.user.set_password('new-password')
+            self.user.save()
+            self.assertEqual(self.client.get('/api/user/', **headers).status_code, 401)
+
+            # Also refused when the user is served from the cache
+            self.assertEqual(self.get_user_info().status_code, 200)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get('/api/user/', **headers).status_code, 401)
+
+
+@override_settings(WHATSAPP_ENABLED=True)
+class BulkOrderStatusTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(self.admin)
+        self.customer = User.objects.create_user('ravi', 'ravi@example.com', 'pw')
+
+    def mark(self, action, orders):
+        return self.client.post(
+            '/admin/yksshop/order/', {'action': action, '_selected_action': [order.pk for order in orders]},
+        )
+
+    def test_admin_action_costs_the_same_queries_for_any_selection(self):
+        few = [make_order(self.customer) for _ in range(3)]
+        many = [make_order(self.customer) for _ in range(240)]
+        with CaptureQueriesContext(connection) as baseline:
+            self.mark('mark_shipped', few)
+
+        # Django assumes SQLite's old 999-variable limit and would split the outbox
+        # INSERT; PostgreSQL has no such limit
+        with mock.patch.object(connection.features, 'max_query_params', 32766):
+            with self.assertNumQueries(len(baseline)):
+                self.mark('mark_shipped', many)
+        self.assertEqual(Order.objects.filter(status='shipped').count(), 243)
+
+    def test_one_coalesced_notification_per_order_and_channel(self):
+        orders = [make_order(self.customer) for _ in range(5)]
+        self.mark('mark_shipped', orders)
+        self.mark('mark_delivered', orders)
+
+        updates = OutboxMessage.objects.filter(kind='order_status_update')
+        self.assertEqual(updates.count(), len(orders) * 2)
+        self.assertEqual(
+            {tuple(message.payload['trail']) for message in updates}, {('pending', 'shipped', 'delivered')},
+        )
+
+
+class PageQueryCountTests(TestCase):
+    """Pages must cost the same number of queries however many products or lines they show"""
+
+    def setUp(self):
+        HomeHero.get_solo()
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'pw')
+        self.client.force_login(self.user)
+        self.category = make_category()
+        self.cart = Cart.objects.create(user=self.user)
+
+    def add_products(self, count, in_cart=False):
+        start = Product.objects.count()
+        for i in range(start, start + count):
+            product = make_product(self.category, f'Shirt {i}')
+            ProductImage.objects.create(product=product, image=f'shirts/shirt-{i}')
+            ProductVariant.objects.bulk_create([
+                ProductVariant(product=product, size='M', stock=3), ProductVariant(product=product, size='L', stock=0),
+            ])
+            if in_cart:
+                CartItem.objects.create(cart=self.cart, product=product, quantity=1, size='M')
+
+    def queries(self, url):
+        # Same (cold) cache state for every measurement
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(context)
+
+    def assertConstantQueries(self, url, in_cart=False):
+        self.add_products(2, in_cart)
+        few = self.queries(url)
+        self.add_products(10, in_cart)
+        self.assertEqual(self.queries(url), few)
+
+    def test_product_listing(self):
+        self.assertConstantQueries('/products/')
+
+    def test_homepage(self):
+        self.assertConstantQueries('/home/')
+
+    def test_cart(self):
+        self.assertConstantQueries('/cart/', in_cart=True)
+
+    def test_checkout(self):
+        self.assertConstantQueries('/checkout/', in_cart=True)
+
+
+class OrderNumberTests(TestCase):
+    def test_numbers_are_unique_and_sorted_within_one_millisecond(self):
+        allocator = OrderNumberAllocator()
+        with mock.patch('yksshop.order_numbers.time.time_ns', return_value=1_700_000_000_000_000_000):
+            numbers = [allocator.allocate() for _ in range(1000)]
+        self.assertEqual(numbers, sorted(set(numbers)))
+        self.assertTrue(all(len(number) == 18 for number in numbers))
+
+
+@override_settings(WHATSAPP_ENABLED=True)
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('ravi', 'ravi@example.com', 'pw', first_name='Ravi')
+        self.user.profile.phone = '9876543210'
+        self.user.profile.save()
+
+    def due(self):
+        OutboxMessage.objects.update(next_attempt_at=timezone.now())
+
+    def test_new_order_queues_a_confirmation_per_channel(self):
+        order = make_order(self.user)
+        self.assertEqual(
+            sorted(order.notifications.values_list('kind', 'channel', 'status')),
+            [('order_confirmation', 'email', 'pending'), ('order_confirmation', 'whatsapp', 'pending')],
+        )
+
+    def test_status_change_and_its_notification_commit_together(self):
+        order = make_order(self.user, payment_method='razorpay', razorpay_order_id='order_1')
+        OutboxMessage.objects.all().delete()
+        self.client.force_login(self.user)
+        with mock.patch('yksshop.signals.enqueue_order_status_update', side_effect=DatabaseError('outbox down')):
+            response = self.client.post('/payment/failure/', {'razorpay_order_id': 'order_1', 'order_id': order.pk})
+        self.assertFalse(response.json()['success'])
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'pending')
+
+        self.client.post('/payment/failure/', {'razorpay_order_id': 'order_1', 'order_id': order.pk})
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'cancelled')
+        self.assertEqual(order.notifications.filter(kind='order_status_update').count(), 2)
+
+    def test_claim_leases_due_messages_until_the_lease_runs_out(self):
+        make_order(self.user)
+        self.assertEqual(len(outbox.claim(10)), 2)
+        self.assertEqual(outbox.claim(10), [])
+        self.assertTrue(all(
+            message.status == 'sending' and message.next_attempt_at > timezone.now()
+            for message in OutboxMessage.objects.all()
+        ))
+
+        # A worker died holding them: they come back once the lease has expired
+        self.due()
+        self.assertEqual(len(outbox.claim(10)), 2)
+
+    def test_claim_locks_only_outbox_rows(self):
+        # SQLite has no FOR UPDATE; compile the claim query as a backend that has one
+        features = {'has_select_for_update': True, 'has_select_for_update_skip_locked': True,
+                    'has_select_for_update_of': True}
+        with mock.patch.multiple(connection.features, **features):
+            sql, _ = outbox._due(timezone.now()).query.get_compiler(using='default').as_sql()
+        self.assertIn('LEFT OUTER JOIN', sql)
+        self.assertTrue(sql.endswith('FOR UPDATE OF "yksshop_outboxmessage" SKIP LOCKED'), sql)
+
+    def test_failures_back_off_then_give_up(self):
+        order = make_order(self.user)
+        message = order.notifications.get(channel='email')
+        for attempt in range(1, outbox.MAX_ATTEMPTS):
+            outbox.record(message, False, 'smtp down')
+            message.refresh_from_db()
+            self.assertEqual((message.status, message.attempts), ('pending', attempt))
+            self.assertGreater(message.next_attempt_at, timezone.now() + outbox._backoff(attempt) - timedelta(seconds=5))
+
+        outbox.record(message, False, 'smtp down')
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.last_error), ('failed', 'smtp down'))
+
+    def test_worker_delivers_email_and_whatsapp(self):
+        stub = StubTwilio()
+        self.addCleanup(stub.close)
+        whatsapp._client = None
+        self.addCleanup(setattr, whatsapp, '_client', None)
+
+        with self.settings(TWILIO_ACCOUNT_SID='AC123', TWILIO_AUTH_TOKEN='secret',
+                           TWILIO_WHATSAPP_FROM='+14155238886', TWILIO_API_BASE=stub.url):
+            order = make_order(self.user)
+            self.assertEqual(outbox.process_batch(workers=1), (2, 2))
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(order.order_number, mail.outbox[0].subject)
+        self.assertEqual(mail.outbox[0].to, ['ravi@example.com'])
+        self.assertEqual(len(stub.requests), 1)
+        self.assertEqual(stub.requests[0]['To'], ['whatsapp:+919876543210'])
+        self.assertEqual(set(order.notifications.values_list('status', flat=True)), {'sent'})
+
+    @override_settings(WHATSAPP_ENABLED=False)
+    def test_failed_email_is_rescheduled(self):
+        make_order(self.user)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('refused')):
+            self.assertEqual(outbox.process_batch(workers=1), (1, 0))
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.status, message.attempts, message.last_error), ('pending', 1, 'refused'))
+
+        self.due()
+        self.assertEqual(outbox.process_batch(workers=1), (1, 1))
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class StubSMTPBackend(BaseEmailBackend):
+    """
+    Email backend that behaves like an SMTP connection: counts real connects,
+    refuses `refused` recipients, and can hang up after `drop_after` messages.
+    """
+
+    def __init__(self, refused=(), drop_after=None, **kwargs):
+        super().__init__(**kwargs)
+        self.refused = set(refused)
+        self.drop_after = drop_after
+        self.connected = False
+        self.connects = 0
+        self.sent = []
+
+    def open(self):
+        if self.connected:
+            return False
+        self.connected = True
+        self.connects += 1
+        return True
+
+    def close(self):
+        self.connected = False
+
+    def send_messages(self, messages):
+        if not self.connected:
+            raise smtplib.SMTPServerDisconnected('not connected')
+        for message in messages:
+            if len(self.sent) == self.drop_after:
+                self.drop_after = None
+                self.connected = False
+                raise smtplib.SMTPServerDisconnected('idle timeout')
+            if message.to[0] in self.refused:
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b'No such user')})
+            self.sent.append(message)
+        return len(messages)
+
+
+class BatchMailerTests(TestCase):
+    def send(self, backend, count=20, **kwargs):
+        results = []
+        with BatchMailer(connection=backend, max_batch=5, on_result=lambda *result: results.append(result), **kwargs) as mailer:
+            for i in range(count):
+                mailer.add(EmailMessage('Hi', 'Body', 'shop@example.com', [f'user{i}@example.com']), i)
+        return results
+
+    def test_one_connection_for_many_messages(self):
+        backend = StubSMTPBackend()
+        results = self.send(backend)
+        self.assertEqual(backend.connects, 1)
+        self.assertEqual(len(backend.sent), 20)
+        self.assertEqual([(key, ok) for key, ok, _ in results], [(i, True) for i in range(20)])
+        self.assertFalse(backend.connected)
+
+    def test_failures_are_reported_per_message(self):
+        backend = StubSMTPBackend(refused={'user3@example.com'})
+        results = {key: (ok, error) for key, ok, error in self.send(backend)}
+        self.assertFalse(results[3][0])
+        self.assertIn('No such user', results[3][1])
+        self.assertTrue(all(ok for key, (ok, _) in results.items() if key != 3))
+        self.assertEqual(backend.connects, 1)
+
+    def test_dropped_connection_is_reopened_and_the_message_retried(self):
+        backend = StubSMTPBackend(drop_after=7)
+        results = self.send(backend)
+        self.assertEqual(backend.connects, 2)
+        self.assertEqual(len(backend.sent), 20)
+        self.assertTrue(all(ok for _, ok, _ in results))
+
+
+class FakeClock:
+    """Stands in for time.monotonic/time.sleep: sleeping advances the clock"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        # Advance by at least a microsecond, like a real clock, so float dust
+        # in the bucket's arithmetic can't leave it sleeping in place
+        self.now += max(seconds, 1e-6)
+
+
+def twilio_response(status_code, headers=None):
+    return mock.Mock(status_code=status_code, headers=headers or {}, text='')
+
+
+class WhatsAppClientTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        for name in ('monotonic', 'sleep'):
+            patcher = mock.patch.object(time, name, getattr(self.clock, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = whatsapp.WhatsAppClient('AC123', 'secret', '+14155238886', rate=10, burst=2)
+        self.client.session = mock.Mock()
+        self.post = self.client.session.post
+
+    def test_token_bucket_holds_sends_to_the_rate(self):
+        self.post.return_value = twilio_response(201)
+        for _ in range(6):
+            self.assertTrue(self.client.send('9876543210', 'hi'))
+        # A burst of 2, then one send per 0.1s
+        self.assertAlmostEqual(sum(self.clock.sleeps), 0.4)
+        self.assertEqual(self.post.call_args.kwargs['data']['To'], 'whatsapp:+919876543210')
+
+    def test_429_is_retried_honouring_a_capped_retry_after(self):
+        self.post.side_effect = [
+            twilio_response(429, {'Retry-After': '7200'}),
+            twilio_response(503),
+            twilio_response(201),
+        ]
+        self.assertTrue(self.client.send('9876543210', 'hi'))
+        self.assertEqual(self.post.call_count, 3)
+        self.assertEqual(self.clock.sleeps[0], whatsapp.MAX_RETRY_AFTER)
+        # Jittered exponential backoff for the 503 (attempt 1: up to 1s)
+        self.assertLessEqual(self.clock.sleeps[-1], 1)
+
+    def test_gives_up_after_max_retries(self):
+        self.post.return_value = twilio_response(429)
+        self.assertFalse(self.client.send('9876543210', 'hi'))
+        self.assertEqual(self.post.call_count, self.client.max_retries + 1)
+
+    def test_requests_that_may_have_reached_twilio_are_not_retried(self):
+        for outcome in (twilio_response(500), requests.ReadTimeout('read timed out')):
+            self.post.reset_mock()
+            self.post.side_effect = [outcome, twilio_response(201)]
+            self.assertFalse(self.client.send('9876543210', 'hi'))
+            self.assertEqual(self.post.call_count, 1)
+
+    def test_connect_failures_are_retried(self):
+        self.post.side_effect = [requests.ConnectTimeout('connect timed out'), twilio_response(201)]
+        self.assertTrue(self.client.send('9876543210', 'hi'))
+        self.assertEqual(self.post.call_count, 2)
+
+
+class RestockFanOutTests(TestCase):
+    def setUp(self):
+        self.product = make_product(make_category(), 'Linen Shirt')
+        self.first = StockSubscription.objects.create(product=self.product, email='a@example.com', phone='9000000001')
+        self.second = StockSubscription.objects.create(product=self.product, email='b@example.com', phone='9000000002')
+
+    def test_only_rows_this_job_claimed_are_notified(self):
+        pending = stock_alerts.pending_subscribers
+        calls = []
+
+        def raced(product, size=None):
+            calls.append(product)
+            if len(calls) > 1:
+                return pending(product, size)
+            # An overlapping job claims the first subscriber between our select and claim
+            StockSubscription.objects.filter(pk=self.first.pk).update(notified_at=timezone.now())
+            return StockSubscription.objects.filter(product=product)
+
+        with mock.patch.object(stock_alerts, 'pending_subscribers', side_effect=raced):
+            self.assertEqual(stock_alerts.fan_out_restock(self.product.pk), 1)
+        self.assertEqual([message.to for message in mail.outbox], [['b@example.com']])
+
+    def test_failed_whatsapp_sends_are_rearmed(self):
+        client = mock.Mock()
+        client.send_many.side_effect = lambda messages: [phone != '9000000002' for phone, _ in messages]
+        with mock.patch.object(stock_alerts, 'get_whatsapp_client', return_value=client):
+            self.assertEqual(stock_alerts.fan_out_restock(self.product.pk), 2)
+        self.assertEqual(len(mail.outbox), 2)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertIsNotNone(self.first.notified_at)
+        self.assertIsNone(self.second.notified_at)
+
+
+class SoldOutSubscriptionTests(TestCase):
+    def setUp(self):
+        self.product = make_product(make_category(), 'Linen Shirt', stock=0, is_available=False)
+
+    def test_sold_out_product_can_be_subscribed_to(self):
+        self.assertContains(self.client.get(f'/product/{self.product.slug}/'), 'Notify me')
+        response = self.client.post('/api/stock-subscribe/', {'product_id': self.product.pk, 'email': 'a@example.com'})
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(stock_alerts.pending_subscribers(self.product).count(), 1)
+
+    def test_hidden_product_in_stock_stays_hidden(self):
+        Product.objects.filter(pk=self.product.pk).update(stock=3)
+        self.assertRedirects(self.client.get(f'/product/{self.product.slug}/'), '/home/', fetch_redirect_response=False)
+
+    def test_restock_waits_until_the_product_is_on_sale(self):
+        stock_alerts.subscribe(self.product, email='a@example.com')
+        self.product.stock = 3
+        self.product.save()
+        job = OutboxMessage.objects.get(kind='back_in_stock')
+
+        self.assertEqual(outbox.process_batch(workers=1), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('pending', 0))
+        self.assertGreater(job.next_attempt_at, timezone.now() + outbox.RESTOCK_RECHECK - timedelta(minutes=1))
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.product.is_available = True
+        self.product.save()
+        OutboxMessage.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(outbox.process_batch(workers=1), (1, 1))
+        self.assertEqual([message.to for message in mail.outbox], [['a@example.com']])
@@ -0,0 +1,59 @@
+"""
+Shared version stamps for process-local caches
+Each namespace (e.g. 'catalog') has an integer stored in the Django cache.
+Signal handlers bump it on writes; readers compare it with the version their
+in-memory data was built from and rebuild when it moved.
+
+Missing keys are seeded from the clock rather than 1, so a key that was
+evicted never comes back at a value some process already built data for.
+
+Stamps are only shared when the cache is (Redis via REDIS_URL). With the
+per-process LocMem fallback a bump is invisible to other workers, so readers
+also expire their data after local_max_age() seconds.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+KEY_PREFIX = 'yksshop:version:'
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_shared():
+    """False when every process has its own cache and misses the others' bumps"""
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_BACKENDS
+
+
+def local_max_age(default=None):
+    """
+    Seconds a process may keep data built for one version: `default` (None
+    means until the version moves) with a shared cache, at most
+    LOCAL_CACHE_MAX_AGE otherwise.
+    """
+    if is_shared():
+        return default
+    fallback = getattr(settings, 'LOCAL_CACHE_MAX_AGE', 60)
+    return fallback if default is None else min(default, fallback)
+
+
+def get_version(namespace):
+    key = KEY_PREFIX + namespace
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace):
+    key = KEY_PREFIX + namespace
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Key missing (first write or evicted); any fresh value invalidates readers
+        cache.add(key, time.time_ns(), timeout=None)
+        return cache.incr(key)
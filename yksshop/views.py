@@ -13,22 +13,36 @@ import random
 from .models import (
     Profile,
     PendingUser,
-    Category,
     Product,
     ProductVariant,
     Cart,
     CartItem,
     Order,
-    OrderItem,
-    HomeHero,
 )
+from .cart_batch import CartBatchError, apply_to_cart, apply_to_guest_cart, parse_operations
+from .cart_view import build_cart_view, build_guest_cart_view
+from .conditional import catalog_api_condition, catalog_page_condition, product_detail_condition
+from .context_processors import remember_cart
+from .facets import apply_facets, build_facets, facet_counts, parse_facets
+from .page_cache import anonymous_page_cache
+from .guest_cart import GuestCart, merge_guest_cart, parse_line_id
+from .idempotency import idempotent
+from .orders import ORDER_PAGE_SIZE, OrderError, order_history, place_order_from_cart
+from .pagination import get_page_size, page_urls, paginate_keyset
+from .reference_data import reference_data
+from .search import search_products
+from .stock_alerts import subscribe
+from .suggest import suggest_index
 from .tokens import account_activation_token  # Ensure this is defined correctly
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import logout
-from django.http import JsonResponse
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.decorators.http import require_POST
-from django.db.models import Q
+from django.db import transaction
 import razorpay
 from django.conf import settings
 import json
@@ -197,7 +211,10 @@ def login_view(request):
             user = authenticate(request, username=user_obj.username, password=password)
             if user:
                 login(request, user)
-                return redirect('homepage')
+                response = redirect('homepage')
+                if merge_guest_cart(request, user):
+                    GuestCart.clear_cookie(response)
+                return response
             else:
                 error_message = 'Invalid password'
         except User.DoesNotExist:
@@ -227,7 +244,7 @@ def profile_view(request):
         profile = None
     
     # Get user orders
-    orders = Order.objects.filter(user=user).order_by('-created_at')[:5]
+    orders = Order.objects.filter(user=user).order_by('-created_at', '-id')[:5]
     
     context = {
         'user': user,
@@ -238,98 +255,185 @@ def profile_view(request):
 
 
 # E-commerce Views
+@anonymous_page_cache
 def homepage(request):
-    categories = Category.objects.all()
-    products = Product.objects.filter(is_available=True)[:12]  # Show 12 products on homepage
-    hero_content = HomeHero.get_solo()
-    
-    # Get cart count for logged in users
-    cart_count = 0
-    if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-            cart_count = cart.get_item_count()
-        except Cart.DoesNotExist:
-            pass
+    categories = reference_data.categories
+    products = Product.objects.for_listing().filter(is_available=True)[:12]  # Show 12 products on homepage
+    hero_content = reference_data.hero
     
     context = {
         'categories': categories,
         'products': products,
-        'cart_count': cart_count,
         'hero_content': hero_content,
     }
     return render(request, 'shop/home.html', context)
 
 
-def product_list(request):
-    category_slug = request.GET.get('category')
+def filter_catalog(request):
+    """
+    Apply the shared catalog filters (search, category, price band, size) from the
+    query string.
+
+    Returns:
+        tuple: (filtered products, unfaceted products for facet counts, selected facets, search query)
+    """
     search_query = request.GET.get('search', '')
-    
-    products = Product.objects.filter(is_available=True)
-    
-    if category_slug:
-        products = products.filter(category__slug=category_slug)
-    
+    selected = parse_facets(request.GET)
+
+    unfaceted = Product.objects.filter(is_available=True)
     if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) | Q(description__icontains=search_query)
-        )
-    
-    categories = Category.objects.all()
+        unfaceted = search_products(unfaceted, search_query)
+
+    products = apply_facets(unfaceted.for_listing(), selected)
+    return products, unfaceted, selected, search_query
+
+
+def catalog_page(request, products, search_query):
+    """One keyset page of the catalog; search results are ordered by relevance"""
+    keys = ('search_rank', 'id') if search_query else ('created_at', 'id')
+    return paginate_keyset(
+        products,
+        cursor=request.GET.get('cursor'),
+        page_size=get_page_size(request),
+        keys=keys,
+    )
+
+
+@catalog_page_condition
+@anonymous_page_cache
+def product_list(request):
+    products, unfaceted, selected, search_query = filter_catalog(request)
+    products, next_cursor = catalog_page(request, products, search_query)
+
+    first_page_url, next_page_url = page_urls(request, next_cursor)
     
-    cart_count = 0
-    if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-            cart_count = cart.get_item_count()
-        except Cart.DoesNotExist:
-            pass
+    categories = reference_data.categories
+    counts = facet_counts(unfaceted, selected, categories, search_query)
     
     context = {
         'products': products,
         'categories': categories,
-        'selected_category': category_slug,
+        'facets': build_facets(request, counts, selected, categories),
+        'selected_category': selected['category'],
         'search_query': search_query,
-        'cart_count': cart_count,
+        'first_page_url': first_page_url,
+        'next_page_url': next_page_url,
     }
     return render(request, 'shop/product_list.html', context)
 
 
+def serialize_product(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'slug': product.slug,
+        'category': product.category.slug,
+        'price': float(product.price),
+        'image_url': product.get_image_url,
+        'total_stock': product.total_stock,
+        'has_size_variants': product.has_size_variants,
+        'url': reverse('product_detail', args=[product.slug]),
+    }
+
+
+@catalog_api_condition
+def api_product_list(request):
+    """Paginated catalog JSON: ?category=&price=&size=&search=&cursor=&page_size="""
+    products, unfaceted, selected, search_query = filter_catalog(request)
+    products, next_cursor = catalog_page(request, products.select_related('category'), search_query)
+    data = {
+        'results': [serialize_product(product) for product in products],
+        'next_cursor': next_cursor,
+    }
+    # Facets describe the whole result set, so only the first page carries them
+    if not request.GET.get('cursor'):
+        categories = reference_data.categories
+        counts = facet_counts(unfaceted, selected, categories, search_query)
+        data['facets'] = build_facets(request, counts, selected, categories)
+    return JsonResponse(data)
+
+
+def api_product_suggest(request):
+    """Typeahead: ?q=<prefix>&limit= served from the in-memory suggest index"""
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 8)), 20))
+    except ValueError:
+        limit = 8
+
+    if not query:
+        return JsonResponse({'products': [], 'categories': []})
+    return JsonResponse(suggest_index.suggest(query, limit))
+
+
+@product_detail_condition
+@anonymous_page_cache
 def product_detail(request, slug):
     try:
-        product = Product.objects.get(slug=slug, is_available=True)
+        product = Product.objects.on_display().prefetch_related('images', 'variants').get(slug=slug)
     except Product.DoesNotExist:
         return redirect('homepage')
     
-    cart_count = 0
-    if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-            cart_count = cart.get_item_count()
-        except Cart.DoesNotExist:
-            pass
-    
     gallery_images = product.gallery_images
 
+    variants = product.variants.all()
     context = {
         'product': product,
-        'cart_count': cart_count,
         'gallery_images': gallery_images,
-        'variants': product.variants.all(),
+        'variants': variants,
+        'sold_out_sizes': [variant.size for variant in variants if variant.stock == 0],
     }
     return render(request, 'shop/product_detail.html', context)
 
 
+@require_POST
+def stock_subscribe(request):
+    """Ask to be notified when an out-of-stock product (or size) is back"""
+    try:
+        product = Product.objects.on_display().prefetch_related('variants').get(id=request.POST.get('product_id'))
+    except (Product.DoesNotExist, ValueError):
+        return JsonResponse({'success': False, 'message': 'Product not found'})
+
+    size = request.POST.get('size', '').strip().upper() or None
+    if size and not any(variant.size == size for variant in product.variants.all()):
+        return JsonResponse({'success': False, 'message': 'Selected size is not available'})
+
+    if request.user.is_authenticated:
+        profile = getattr(request.user, 'profile', None)
+        subscribe(product, size, user=request.user, phone=getattr(profile, 'phone', ''))
+    else:
+        email = request.POST.get('email', '').strip()
+        try:
+            validate_email(email)
+        except ValidationError:
+            return JsonResponse({'success': False, 'message': 'Please enter a valid email address'})
+        subscribe(product, size, email=email)
+
+    return JsonResponse({'success': True, 'message': "We'll let you know when it's back in stock"})
+
+
+@ensure_csrf_cookie
+def csrf_cookie(request):
+    """Sets the CSRF cookie for pages served from the anonymous page cache"""
+    return HttpResponse(status=204)
+
+
 def get_or_create_cart(user):
     cart, created = Cart.objects.get_or_create(user=user)
     return cart
 
 
+def lock_cart(user):
+    """
+    The user's cart with its row locked until the transaction ends, so
+    concurrent changes to its lines (and denormalized totals) run one at a time
+    """
+    cart, created = Cart.objects.select_for_update().get_or_create(user=user)
+    return cart
+
+
 @require_POST
 def add_to_cart(request):
-    if not request.user.is_authenticated:
-        return JsonResponse({'success': False, 'message': 'Please login to add items to cart'})
-    
     product_id = request.POST.get('product_id')
     quantity = int(request.POST.get('quantity', 1))
     size = request.POST.get('size', '').strip().upper()
@@ -354,24 +458,32 @@ def add_to_cart(request):
 
         if available_stock < quantity:
             return JsonResponse({'success': False, 'message': 'Insufficient stock for the selected size'})
+
+        if not request.user.is_authenticated:
+            return guest_add_to_cart(request, product, size, quantity, available_stock)
         
-        cart = get_or_create_cart(request.user)
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            size=size,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            cart_item.quantity += quantity
-            if cart_item.quantity > available_stock:
-                cart_item.quantity = available_stock
-            cart_item.save()
-        else:
-            if cart_item.quantity > available_stock:
-                cart_item.quantity = available_stock
+        with transaction.atomic():
+            cart = lock_cart(request.user)
+            cart_item, created = CartItem.objects.get_or_create(
+                cart=cart,
+                product=product,
+                size=size,
+                defaults={'quantity': quantity}
+            )
+            old_quantity = 0 if created else cart_item.quantity
+            
+            if not created:
+                cart_item.quantity += quantity
+                if cart_item.quantity > available_stock:
+                    cart_item.quantity = available_stock
                 cart_item.save()
+            else:
+                if cart_item.quantity > available_stock:
+                    cart_item.quantity = available_stock
+                    cart_item.save()
+
+            delta = cart_item.quantity - old_quantity
+            cart.adjust_totals(delta, product.price * delta)
         
         cart_count = cart.get_item_count()
         cart_total = float(cart.get_total())
@@ -388,40 +500,49 @@ def add_to_cart(request):
         return JsonResponse({'success': False, 'message': str(e)})
 
 
-@login_required
 def view_cart(request):
+    if not request.user.is_authenticated:
+        cart_view = build_guest_cart_view(GuestCart.from_request(request))
+        context = {
+            'cart': cart_view,
+            'cart_items': cart_view,
+        }
+        return render(request, 'shop/cart.html', context)
+
     cart = get_or_create_cart(request.user)
-    cart_items = cart.items.all()
+    remember_cart(request, cart)
+    cart_view = build_cart_view(cart)
     
     context = {
-        'cart': cart,
-        'cart_items': cart_items,
-        'cart_count': cart.get_item_count(),
+        'cart': cart_view,
+        'cart_items': cart_view,
     }
     return render(request, 'shop/cart.html', context)
 
 
-@login_required
 @require_POST
 def update_cart(request):
+    if not request.user.is_authenticated:
+        return guest_update_cart(request)
+
     cart_item_id = request.POST.get('cart_item_id')
     quantity = int(request.POST.get('quantity', 1))
     
     try:
-        cart_item = CartItem.objects.get(id=cart_item_id, cart__user=request.user)
-        
-        if quantity <= 0:
-            cart = cart_item.cart
-            cart_item.delete()
-            cart_count = cart.get_item_count()
-            cart_total = float(cart.get_total())
-            return JsonResponse({
-                'success': True,
-                'cart_count': cart_count,
-                'cart_total': cart_total,
-                'item_removed': True,
-            })
-        else:
+        with transaction.atomic():
+            cart = lock_cart(request.user)
+            cart_item = cart.items.select_related('product').get(id=cart_item_id)
+
+            if quantity <= 0:
+                cart_item.delete()
+                cart.adjust_totals(-cart_item.quantity, -cart_item.get_total())
+                return JsonResponse({
+                    'success': True,
+                    'cart_count': cart.get_item_count(),
+                    'cart_total': float(cart.get_total()),
+                    'item_removed': True,
+                })
+
             product = cart_item.product
             available_stock = product.stock
 
@@ -430,10 +551,11 @@ def update_cart(request):
 
             if quantity > available_stock:
                 return JsonResponse({'success': False, 'message': 'Insufficient stock for the selected size'})
+            delta = quantity - cart_item.quantity
             cart_item.quantity = quantity
             cart_item.save()
+            cart.adjust_totals(delta, product.price * delta)
         
-        cart = cart_item.cart
         cart_count = cart.get_item_count()
         cart_total = float(cart.get_total())
         item_total = float(cart_item.get_total())
@@ -451,15 +573,19 @@ def update_cart(request):
         return JsonResponse({'success': False, 'message': 'Cart item not found'})
 
 
-@login_required
 @require_POST
 def remove_from_cart(request):
+    if not request.user.is_authenticated:
+        return guest_remove_from_cart(request)
+
     cart_item_id = request.POST.get('cart_item_id')
     
     try:
-        cart_item = CartItem.objects.get(id=cart_item_id, cart__user=request.user)
-        cart = cart_item.cart
-        cart_item.delete()
+        with transaction.atomic():
+            cart = lock_cart(request.user)
+            cart_item = cart.items.select_related('product').get(id=cart_item_id)
+            cart_item.delete()
+            cart.adjust_totals(-cart_item.quantity, -cart_item.get_total())
         
         cart_count = cart.get_item_count()
         cart_total = float(cart.get_total())
@@ -473,12 +599,103 @@ def remove_from_cart(request):
         return JsonResponse({'success': False, 'message': 'Cart item not found'})
 
 
+@require_POST
+def cart_batch(request):
+    """
+    Apply many cart operations in one request and transaction.
+    Body: {"operations": [{"op": "add"|"update"|"remove", ...}, ...]} (see cart_batch.py)
+    """
+    try:
+        operations = parse_operations(json.loads(request.body or b'{}'))
+        if request.user.is_authenticated:
+            cart = get_or_create_cart(request.user)
+            items = apply_to_cart(cart, operations)
+        else:
+            cart = GuestCart.from_request(request)
+            items = apply_to_guest_cart(cart, operations)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Invalid JSON body'})
+    except CartBatchError as e:
+        return JsonResponse({'success': False, 'message': str(e)})
+
+    response = JsonResponse({
+        'success': True,
+        'cart_count': cart.get_item_count(),
+        'cart_total': float(cart.get_total()),
+        'items': items,
+    })
+    if not request.user.is_authenticated:
+        cart.save(response)
+    return response
+
+
+# Guest cart (anonymous visitors): same operations, stored in a signed cookie
+def guest_cart_response(guest_cart, data):
+    data.update({
+        'success': True,
+        'cart_count': guest_cart.get_item_count(),
+        'cart_total': float(guest_cart.get_total()),
+    })
+    response = JsonResponse(data)
+    guest_cart.save(response)
+    return response
+
+
+def guest_add_to_cart(request, product, size, quantity, available_stock):
+    guest_cart = GuestCart.from_request(request)
+    new_quantity = min(guest_cart.get_quantity(product.id, size) + quantity, available_stock)
+    if not guest_cart.set_quantity(product.id, size, new_quantity):
+        return JsonResponse({'success': False, 'message': 'Your cart is full. Please login to add more items.'})
+    return guest_cart_response(guest_cart, {'message': 'Product added to cart'})
+
+
+def guest_update_cart(request):
+    line = parse_line_id(request.POST.get('cart_item_id'))
+    quantity = int(request.POST.get('quantity', 1))
+    guest_cart = GuestCart.from_request(request)
+
+    if line is None or not guest_cart.get_quantity(*line):
+        return JsonResponse({'success': False, 'message': 'Cart item not found'})
+    product_id, size = line
+
+    if quantity <= 0:
+        guest_cart.set_quantity(product_id, size, 0)
+        return guest_cart_response(guest_cart, {'item_removed': True})
+
+    try:
+        product = Product.objects.prefetch_related('variants').get(id=product_id)
+    except Product.DoesNotExist:
+        return JsonResponse({'success': False, 'message': 'Cart item not found'})
+
+    available_stock = product.get_stock_for_size(size)
+    if quantity > available_stock:
+        return JsonResponse({'success': False, 'message': 'Insufficient stock for the selected size'})
+    guest_cart.set_quantity(product_id, size, quantity)
+
+    return guest_cart_response(guest_cart, {
+        'item_removed': False,
+        'item_total': float(product.price * quantity),
+        'available_stock': available_stock,
+    })
+
+
+def guest_remove_from_cart(request):
+    line = parse_line_id(request.POST.get('cart_item_id'))
+    guest_cart = GuestCart.from_request(request)
+
+    if line is None or not guest_cart.get_quantity(*line):
+        return JsonResponse({'success': False, 'message': 'Cart item not found'})
+    guest_cart.set_quantity(*line, 0)
+    return guest_cart_response(guest_cart, {})
+
+
 @login_required
 def checkout(request):
     cart = get_or_create_cart(request.user)
-    cart_items = cart.items.all()
+    remember_cart(request, cart)
+    cart_view = build_cart_view(cart)
     
-    if not cart_items.exists():
+    if not cart_view:
         return redirect('view_cart')
     
     # Get user profile for pre-filling
@@ -488,8 +705,8 @@ def checkout(request):
         profile = None
     
     context = {
-        'cart': cart,
-        'cart_items': cart_items,
+        'cart': cart_view,
+        'cart_items': cart_view,
         'profile': profile,
     }
     return render(request, 'shop/checkout.html', context)
@@ -497,13 +714,8 @@ def checkout(request):
 
 @login_required
 @require_POST
+@idempotent
 def place_order(request):
-    cart = get_or_create_cart(request.user)
-    cart_items = cart.items.all()
-    
-    if not cart_items.exists():
-        return JsonResponse({'success': False, 'message': 'Your cart is empty'})
-    
     # Get shipping details
     shipping_name = request.POST.get('shipping_name')
     shipping_phone = request.POST.get('shipping_phone')
@@ -519,60 +731,17 @@ def place_order(request):
     if payment_method not in ['online', 'cod']:
         return JsonResponse({'success': False, 'message': 'Invalid payment method'})
     
-    # Check stock availability
-    for item in cart_items:
-        product = item.product
-        available_stock = product.stock
-
-        if product.has_size_variants and item.size:
-            available_stock = product.get_stock_for_size(item.size)
-            if available_stock < item.quantity:
-                return JsonResponse({'success': False, 'message': f'Insufficient stock for {product.name} (Size {item.size})'})
-        else:
-            if item.quantity > available_stock:
-                return JsonResponse({'success': False, 'message': f'Insufficient stock for {product.name}'})
-    
-    # Create order
-    order = Order.objects.create(
-        user=request.user,
-        payment_method=payment_method,
-        total_amount=cart.get_total(),
-        shipping_name=shipping_name,
-        shipping_phone=shipping_phone,
-        shipping_address=shipping_address,
-        shipping_city=shipping_city,
-        shipping_state=shipping_state,
-        shipping_pincode=shipping_pincode,
-    )
-    
-    # Create order items and update stock
-    for item in cart_items:
-        OrderItem.objects.create(
-            order=order,
-            product=item.product,
-            quantity=item.quantity,
-            price=item.product.price,
-            size=item.size
-        )
-        # Update product stock / variant stock
-        product = item.product
-        if product.has_size_variants and item.size:
-            try:
-                variant = product.variants.get(size=item.size)
-                variant.stock = max(variant.stock - item.quantity, 0)
-                variant.save()
-                product.stock = product.total_stock
-                product.is_available = product.total_stock > 0
-                product.save(update_fields=['stock', 'is_available'])
-            except ProductVariant.DoesNotExist:
-                pass
-        else:
-            product.stock = max(product.stock - item.quantity, 0)
-            product.is_available = product.stock > 0
-            product.save(update_fields=['stock', 'is_available'])
-    
-    # Clear cart
-    cart_items.delete()
+    try:
+        order = place_order_from_cart(request.user, payment_method, {
+            'shipping_name': shipping_name,
+            'shipping_phone': shipping_phone,
+            'shipping_address': shipping_address,
+            'shipping_city': shipping_city,
+            'shipping_state': shipping_state,
+            'shipping_pincode': shipping_pincode,
+        })
+    except OrderError as e:
+        return JsonResponse({'success': False, 'message': str(e)})
     
     if payment_method == 'online':
         # For online payment, create Razorpay order
@@ -615,14 +784,16 @@ def place_order(request):
                 'redirect_to_payment': True
             })
         except Exception as e:
-            # If Razorpay fails, mark order as failed
-            order.payment_status = 'failed'
-            order.status = 'cancelled'
-            order.save()
+            # If Razorpay fails, mark order as failed (with its notification, atomically)
+            with transaction.atomic():
+                order.payment_status = 'failed'
+                order.status = 'cancelled'
+                order.save()
+            # 502, so an idempotent retry places a fresh order instead of replaying this
             return JsonResponse({
                 'success': False,
                 'message': f'Payment gateway error: {str(e)}'
-            })
+            }, status=502)
     else:
         # Cash on delivery
         order.status = 'pending'
@@ -651,10 +822,17 @@ def order_success(request, order_id):
 
 @login_required
 def order_list(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    orders, next_cursor = paginate_keyset(
+        order_history(request.user),
+        cursor=request.GET.get('cursor'),
+        page_size=get_page_size(request, default=ORDER_PAGE_SIZE),
+    )
+    first_page_url, next_page_url = page_urls(request, next_cursor)
     
     context = {
         'orders': orders,
+        'first_page_url': first_page_url,
+        'next_page_url': next_page_url,
     }
     return render(request, 'shop/order_list.html', context)
 
@@ -662,7 +840,7 @@ def order_list(request):
 @login_required
 def order_detail(request, order_id):
     try:
-        order = Order.objects.get(id=order_id, user=request.user)
+        order = order_history(request.user).get(id=order_id)
     except Order.DoesNotExist:
         return redirect('order_list')
     
@@ -675,6 +853,7 @@ def order_detail(request, order_id):
 # Razorpay Payment Views
 @login_required
 @require_POST
+@idempotent
 def payment_success(request):
     """Handle successful Razorpay payment"""
     try:
@@ -708,17 +887,20 @@ def payment_success(request):
         try:
             client.utility.verify_payment_signature(params_dict)
         except razorpay.errors.SignatureVerificationError:
-            order.payment_status = 'failed'
-            order.status = 'cancelled'
-            order.save()
+            # The status change and its queued notification commit together
+            with transaction.atomic():
+                order.payment_status = 'failed'
+                order.status = 'cancelled'
+                order.save()
             return JsonResponse({'success': False, 'message': 'Payment verification failed'})
         
         # Payment verified successfully
-        order.razorpay_payment_id = razorpay_payment_id
-        order.razorpay_signature = razorpay_signature
-        order.payment_status = 'completed'
-        order.status = 'processing'  # Move to processing after successful payment
-        order.save()
+        with transaction.atomic():
+            order.razorpay_payment_id = razorpay_payment_id
+            order.razorpay_signature = razorpay_signature
+            order.payment_status = 'completed'
+            order.status = 'processing'  # Move to processing after successful payment
+            order.save()
         
         return JsonResponse({
             'success': True,
@@ -727,11 +909,13 @@ def payment_success(request):
         })
         
     except Exception as e:
-        return JsonResponse({'success': False, 'message': f'Error processing payment: {str(e)}'})
+        # A 5xx isn't stored by @idempotent, so the client's retry runs the view again
+        return JsonResponse({'success': False, 'message': f'Error processing payment: {str(e)}'}, status=500)
 
 
 @login_required
 @require_POST
+@idempotent
 def payment_failure(request):
     """Handle failed Razorpay payment"""
     try:
@@ -746,10 +930,11 @@ def payment_failure(request):
         except Order.DoesNotExist:
             return JsonResponse({'success': False, 'message': 'Order not found'})
         
-        # Mark payment as failed
-        order.payment_status = 'failed'
-        order.status = 'cancelled'
-        order.save()
+        # Mark payment as failed (status change and notification commit together)
+        with transaction.atomic():
+            order.payment_status = 'failed'
+            order.status = 'cancelled'
+            order.save()
         
         return JsonResponse({
             'success': False,
@@ -758,4 +943,4 @@ def payment_failure(request):
         })
         
     except Exception as e:
-        return JsonResponse({'success': False, 'message': f'Error: {str(e)}'})
+        return JsonResponse({'success': False, 'message': f'Error: {str(e)}'}, status=500)
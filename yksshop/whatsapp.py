@@ -0,0 +1,169 @@
+"""
+WhatsApp delivery through the Twilio Messages API
+One WhatsAppClient per process keeps a requests.Session, so messages reuse
+pooled keep-alive connections instead of a new TCP/TLS setup per send. A token
+bucket keeps the send rate under the account's limit, and sends that Twilio
+certainly didn't act on (connection never made, 429, 503) are retried with
+jittered exponential backoff, honouring Retry-After up to MAX_RETRY_AFTER.
+Creating a message isn't idempotent, so read timeouts and other 5xx responses
+are not retried: the message may already be on its way.
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+TWILIO_API_BASE = 'https://api.twilio.com'
+# Rejected before any message was created
+RETRY_STATUSES = {429, 503}
+MAX_RETRY_AFTER = 30  # seconds
+
+
+def normalize_phone(phone_number):
+    """E.164-style number; numbers without a country code are assumed to be Indian"""
+    phone_number = ''.join(ch for ch in str(phone_number) if ch.isdigit() or ch == '+')
+    if phone_number.startswith('+'):
+        return phone_number
+    if phone_number.startswith('0'):
+        return '+91' + phone_number[1:]
+    return '+91' + phone_number
+
+
+def _never_sent(error):
+    """True if the request failed before reaching Twilio, so a retry can't duplicate it"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        # Refused / DNS failure / connect timeout, wrapped in urllib3's MaxRetryError
+        return isinstance(getattr(error.args[0], 'reason', None), ConnectTimeoutError)
+    return False
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class WhatsAppClient:
+    def __init__(self, account_sid, auth_token, from_number, rate=10, burst=None,
+                 max_retries=3, pool_size=10, timeout=10, base_url=TWILIO_API_BASE):
+        self.from_number = normalize_phone(from_number)
+        self.url = f"{base_url.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.bucket = TokenBucket(rate, burst)
+
+        self.session = requests.Session()
+        self.session.auth = (account_sid, auth_token)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(max(float(retry_after), 0), MAX_RETRY_AFTER)
+            except ValueError:
+                pass
+        # Full jitter: spread concurrent retries out instead of retrying in lockstep
+        return random.uniform(0, min(30, 0.5 * 2 ** attempt))
+
+    def send(self, phone_number, body):
+        """
+        Returns:
+            bool: True once Twilio has accepted the message (HTTP 201)
+        """
+        payload = {
+            'From': f'whatsapp:{self.from_number}',
+            'To': f'whatsapp:{normalize_phone(phone_number)}',
+            'Body': body,
+        }
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            response = None
+            try:
+                response = self.session.post(self.url, data=payload, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                print(f"WhatsApp request to {payload['To']} failed: {e}")
+                if not _never_sent(e):
+                    # Twilio may have created the message; a retry could send it twice
+                    return False
+            else:
+                if response.status_code == 201:
+                    return True
+                if response.status_code not in RETRY_STATUSES:
+                    print(f"Error sending WhatsApp: {response.status_code} - {response.text}")
+                    return False
+            if attempt < self.max_retries:
+                time.sleep(self._backoff(attempt, response))
+
+        print(f"Giving up on WhatsApp message to {payload['To']} after {self.max_retries + 1} attempts")
+        return False
+
+    def send_many(self, messages, workers=None):
+        """
+        Send (phone_number, body) pairs concurrently over the shared session.
+
+        Returns:
+            list: bool per message, in input order
+        """
+        with ThreadPoolExecutor(max_workers=workers or self.pool_size) as pool:
+            return list(pool.map(lambda message: self.send(*message), messages))
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_whatsapp_client():
+    """
+    The process-wide client built from settings, or None if WhatsApp is disabled
+    or Twilio credentials are missing.
+    """
+    global _client
+    if not getattr(settings, 'WHATSAPP_ENABLED', False):
+        return None
+    account_sid = getattr(settings, 'TWILIO_ACCOUNT_SID', None)
+    auth_token = getattr(settings, 'TWILIO_AUTH_TOKEN', None)
+    whatsapp_from = getattr(settings, 'TWILIO_WHATSAPP_FROM', None)
+    if not all([account_sid, auth_token, whatsapp_from]):
+        return None
+
+    with _client_lock:
+        if _client is None:
+            _client = WhatsAppClient(
+                account_sid,
+                auth_token,
+                whatsapp_from,
+                rate=getattr(settings, 'WHATSAPP_RATE_LIMIT', 10),
+                base_url=getattr(settings, 'TWILIO_API_BASE', TWILIO_API_BASE),
+            )
+    return _client